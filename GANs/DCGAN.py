@@ -12,6 +12,7 @@ import json
 from datetime import datetime
 
 from dataloaders import get_mnist
+from telemetry import Telemetry, configure
 
 
 parser = argparse.ArgumentParser()
@@ -38,6 +39,7 @@ if not os.path.exists(args.folder):
 
 with open(f'{args.folder}/params.json', 'w') as outfile:
     json.dump(params, outfile)
+configure(jsonl=f'{args.folder}/metrics.jsonl')
 
 use_cuda = torch.cuda.is_available()
 device = torch.device('cuda' if use_cuda else 'cpu')
@@ -171,22 +173,26 @@ def train_generator(x, G, D, loss, G_opt):
 def train_one_epoch_efficient(dataloader, G, D, loss, G_opt, D_opt):
     'fast implementation of one discriminator per generator update'
     g_losses, d_losses = [], []
-    for i, (x, _) in enumerate(dataloader):
-        g_loss, d_loss, fake_data = train_one_batch(x, G, D, loss, G_opt, D_opt)
+    telemetry = Telemetry('train', len(dataloader))
+    for i, (x, _) in enumerate(telemetry.wrap(dataloader)):
+        d_loss, g_loss, fake_data = train_one_batch(x, G, D, loss, G_opt, D_opt)
         g_losses.append(g_loss)
         d_losses.append(d_loss)
+        telemetry.update(x.size(0), d_loss=d_loss, g_loss=g_loss)
     return d_losses, g_losses, fake_data
 
 
 def train_one_epoch_original(dataloader, G, D, loss, G_opt, D_opt):
     'follow the training regime in the GAN paper'
     g_losses, d_losses = [], []
-    for i, (x, _) in enumerate(dataloader):
+    telemetry = Telemetry('train', len(dataloader))
+    for i, (x, _) in enumerate(telemetry.wrap(dataloader)):
         d_loss, fake_data = train_discriminator(x, G, D, loss, D_opt)
         d_losses.append(d_loss)
         if i % args.num_disc_updates == 0:
             g_loss = train_generator(x, G, D, loss, G_opt)
             g_losses.append(g_loss)
+        telemetry.update(x.size(0), d_loss=d_loss, g_loss=g_loss)
     return d_losses, g_losses, fake_data
 
 
@@ -7,12 +7,15 @@ from torchvision import datasets, transforms
 from torch.autograd import Variable
 from torchvision.utils import save_image
 import os
+import copy
 import argparse
 import time
 import json
 from datetime import datetime
 
 from dataloaders import get_mnist
+from telemetry import Telemetry, configure
+from lowrank import factorise, report
 
 
 parser = argparse.ArgumentParser()
@@ -23,6 +26,14 @@ parser.add_argument("--latent_dim", type=int, default=100)
 parser.add_argument("--num_disc_updates", type=int, default=1)
 parser.add_argument("--train_original", action='store_true')
 parser.add_argument("--folder", default=None)
+parser.add_argument("--save_model", action='store_true')
+parser.add_argument("--weights", default=None,
+                    help='folder a --save_model run wrote G.pt and D.pt to')
+parser.add_argument("--rank", type=float, default=0,
+                    help='factorise --layers: below 1 the fraction of parameters kept, '
+                         'otherwise the rank')
+parser.add_argument("--layers", nargs='+',
+                    default=['G.fc2', 'G.fc3', 'G.fc4', 'D.fc1', 'D.fc2', 'D.fc3'])
 args = parser.parse_args()
 
 # create folder of all arguments
@@ -39,6 +50,7 @@ if not os.path.exists(args.folder):
 
 with open(f'{args.folder}/params.json', 'w') as outfile:
     json.dump(params, outfile)
+configure(jsonl=f'{args.folder}/metrics.jsonl')
 
 use_cuda = torch.cuda.is_available()
 device = torch.device('cuda' if use_cuda else 'cpu')
@@ -134,30 +146,54 @@ def train_generator(x, G, D, loss, G_opt):
 def train_one_epoch_efficient(dataloader, G, D, loss, G_opt, D_opt):
     'fast implementation of one discriminator per generator update'
     g_losses, d_losses = [], []
-    for i, (x, _) in enumerate(dataloader):
-        g_loss, d_loss, fake_data = train_one_batch(x, G, D, loss, G_opt, D_opt)
+    telemetry = Telemetry('train', len(dataloader))
+    for i, (x, _) in enumerate(telemetry.wrap(dataloader)):
+        d_loss, g_loss, fake_data = train_one_batch(x, G, D, loss, G_opt, D_opt)
         g_losses.append(g_loss)
         d_losses.append(d_loss)
+        telemetry.update(x.size(0), d_loss=d_loss, g_loss=g_loss)
     return d_losses, g_losses, fake_data
 
 
 def train_one_epoch_original(dataloader, G, D, loss, G_opt, D_opt):
     'follow the training regime in the GAN paper'
     g_losses, d_losses = [], []
-    for i, (x, _) in enumerate(dataloader):
+    telemetry = Telemetry('train', len(dataloader))
+    for i, (x, _) in enumerate(telemetry.wrap(dataloader)):
         d_loss, fake_data = train_discriminator(x, G, D, loss, D_opt)
         d_losses.append(d_loss)
         if i % args.num_disc_updates == 0:
             g_loss = train_generator(x, G, D, loss, G_opt)
             g_losses.append(g_loss)
+        telemetry.update(x.size(0), d_loss=d_loss, g_loss=g_loss)
     return d_losses, g_losses, fake_data
 
 
+def factorised(G, D, x):
+    'swap the chosen layers for low rank pairs and report what that costs'
+    nets = {'G': G, 'D': D}
+    probes = {'G': torch.randn(x.size(0), args.latent_dim).to(device),
+              'D': x.view(-1, 28 * 28).to(device)}
+    for prefix, net in nets.items():
+        names = [n.split('.', 1)[1] for n in args.layers if n.split('.')[0] == prefix]
+        if names:
+            dense = copy.deepcopy(net)
+            ranks = factorise(net, names, args.rank)
+            print(f'{prefix}: ranks {ranks}')
+            report(dense, net, names, probes[prefix])
+
+
 def main():
     dataloader = get_mnist('../data', use_cuda, args.batch_size)
     mnist_dim = 28 * 28
     G = Generator(args.latent_dim, mnist_dim).to(device)
     D = Discriminator(mnist_dim).to(device)
+    if args.weights is not None:
+        G.load_state_dict(torch.load(f'{args.weights}/G.pt', map_location=device))
+        D.load_state_dict(torch.load(f'{args.weights}/D.pt', map_location=device))
+    if args.rank > 0:
+        # training from here on fine tunes the factorised layers
+        factorised(G, D, next(iter(dataloader))[0])
     G_opt = optim.Adam(G.parameters(), lr=args.lr)
     D_opt = optim.Adam(D.parameters(), lr=args.lr)
     loss = nn.BCELoss()
@@ -180,6 +216,9 @@ def main():
             f'D loss {torch.mean(torch.FloatTensor(d_losses)):.3f}, '\
             f'G loss {torch.mean(torch.FloatTensor(g_losses)):.3f}'
         )
+        if args.save_model:
+            torch.save(G.state_dict(), f'{args.folder}/G.pt')
+            torch.save(D.state_dict(), f'{args.folder}/D.pt')
 
 
 
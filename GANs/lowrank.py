@@ -0,0 +1,118 @@
+"""
+replace dense linear layers with svd initialised low rank pairs
+"""
+import time
+import torch
+import torch.nn as nn
+
+
+class LowRankLinear(nn.Module):
+
+    def __init__(self, in_features, out_features, rank, bias=True):
+        'in_features -> rank -> out_features, a rank limited nn.Linear'
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.rank = rank
+        self.first = nn.Linear(in_features, rank, bias=False)
+        self.second = nn.Linear(rank, out_features, bias=bias)
+
+    @classmethod
+    @torch.no_grad()
+    def from_linear(cls, linear, rank):
+        'the best rank approximation of linear, singular values split evenly'
+        layer = cls(linear.in_features, linear.out_features, rank, linear.bias is not None)
+        layer.to(linear.weight.device)
+        u, s, vh = torch.linalg.svd(linear.weight, full_matrices=False)
+        root = s[:rank].sqrt()
+        layer.first.weight.copy_(root.unsqueeze(1) * vh[:rank])
+        layer.second.weight.copy_(u[:, :rank] * root)
+        if linear.bias is not None:
+            layer.second.bias.copy_(linear.bias)
+        return layer
+
+    def forward(self, x):
+        return self.second(self.first(x))
+
+
+def choose_rank(linear, budget):
+    '''
+    budget below 1 is the fraction of the dense parameters the pair may keep,
+    otherwise it is the rank itself
+    '''
+    if budget >= 1:
+        rank = int(budget)
+    else:
+        rank = int(budget * linear.in_features * linear.out_features
+                   / (linear.in_features + linear.out_features))
+    return max(1, min(rank, linear.in_features, linear.out_features))
+
+
+def linear_flops(layer, rows):
+    'multiply-adds of a forward pass over rows inputs, counted as two flops'
+    if isinstance(layer, LowRankLinear):
+        return 2 * rows * layer.rank * (layer.in_features + layer.out_features)
+    return 2 * rows * layer.in_features * layer.out_features
+
+
+def _set(model, name, layer):
+    parent, _, child = name.rpartition('.')
+    setattr(model.get_submodule(parent) if parent else model, child, layer)
+
+
+def factorise(model, names, budget):
+    'swap the named nn.Linear layers of model in place; returns {name: rank}'
+    ranks = {}
+    for name in names:
+        linear = model.get_submodule(name)
+        ranks[name] = choose_rank(linear, budget)
+        _set(model, name, LowRankLinear.from_linear(linear, ranks[name]))
+    return ranks
+
+
+def _median_ms(function, x, repeats=50):
+    function(x)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(x)
+        times.append(1000 * (time.perf_counter() - start))
+    return sorted(times)[len(times) // 2]
+
+
+@torch.inference_mode()
+def inputs(model, names, x):
+    'what every named layer receives when x passes through model'
+    seen = {}
+
+    def hook(name):
+        def record(module, args, output):
+            seen[name] = args[0]
+        return record
+
+    handles = [model.get_submodule(name).register_forward_hook(hook(name))
+               for name in names]
+    model.eval()
+    model(x)
+    for handle in handles:
+        handle.remove()
+    return seen
+
+
+@torch.inference_mode()
+def report(dense, factorised, names, x):
+    'flops, latency and output error of every factorised layer on its real inputs'
+    seen = inputs(dense, names, x)
+    print(f"{'layer':>16} {'shape':>11} {'rank':>5} {'mflops':>15} "
+          f"{'latency ms':>17} {'error':>7}")
+    for name in names:
+        before, after = dense.get_submodule(name), factorised.get_submodule(name)
+        x = seen[name]
+        rows = x.numel() // x.size(-1)
+        reference = before(x)
+        error = ((after(x) - reference).norm() / reference.norm()).item()
+        print(f'{name:>16} {before.in_features:5d}x{before.out_features:<5d} '
+              f'{after.rank:5d} '
+              f'{linear_flops(before, rows) / 1e6:7.2f}>{linear_flops(after, rows) / 1e6:7.2f} '
+              f'{_median_ms(before, x):8.3f}>{_median_ms(after, x):8.3f} {error:7.4f}')
+
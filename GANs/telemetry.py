@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+rate limited structured step metrics
+"""
+import json
+import time
+import torch
+
+
+settings = {'interval': 0.5, 'jsonl': None}
+
+
+def configure(**kwargs):
+    'interval (seconds between writes) and the jsonl path'
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise ValueError(f'unknown telemetry settings {sorted(unknown)}')
+    settings.update(kwargs)
+
+
+def _float(value):
+    if isinstance(value, torch.Tensor):
+        return value.detach().item()
+    return float(value)
+
+
+class Telemetry:
+
+    def __init__(self, name, total=None):
+        'values passed to update() are only written every interval seconds'
+        self.name = name
+        self.total = total
+        self.steps = 0
+        self.images = 0
+        self.values = {}
+        self.wait = 0.0
+        self.compute = 0.0
+        self.flushed = time.perf_counter()
+        self.since = {'steps': 0, 'images': 0, 'wait': 0.0, 'compute': 0.0}
+
+    def wrap(self, iterable):
+        'yield from iterable, timing the wait for each item and the work on it'
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                ready = time.perf_counter()
+                self.wait += ready - start
+                yield item
+                self.compute += time.perf_counter() - ready
+        finally:
+            # also when the consumer breaks out early or raises
+            self.close()
+
+    def update(self, images=0, **values):
+        'count one step; values (tensors are fine) are what gets written'
+        self.steps += 1
+        self.images += images
+        self.values = values
+        if time.perf_counter() - self.flushed >= settings['interval']:
+            self.flush()
+
+    def flush(self):
+        now = time.perf_counter()
+        steps = self.steps - self.since['steps']
+        if steps == 0 or settings['jsonl'] is None:
+            return
+        metrics = {
+            'name': self.name,
+            'step': self.steps,
+            'total': self.total,
+            'time': time.time(),
+            'step_time': (self.compute - self.since['compute']) / steps,
+            'data_wait': (self.wait - self.since['wait']) / steps,
+            'images_per_sec': (self.images - self.since['images']) / (now - self.flushed),
+            **{k: _float(v) for k, v in self.values.items()},
+        }
+        with open(settings['jsonl'], 'a') as f:
+            f.write(json.dumps(metrics) + '\n')
+        self.flushed = now
+        self.since = {'steps': self.steps, 'images': self.images, 'wait': self.wait,
+                      'compute': self.compute}
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+trade compute for memory by recomputing encoder/decoder stages in backward
+"""
+import contextlib
+import copy
+import time
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+
+# slices of ResidualEncoder.encoder / ResidualDecoder.decoder that line up
+# with encoder1..encoder5 / decoder1..decoder5 of the perceptual models
+ENCODER_STAGES = [(0, 2), (2, 6), (6, 10), (10, 14), (14, 17)]
+DECODER_STAGES = [(0, 3), (3, 7), (7, 11), (11, 15), (15, 18)]
+
+
+@contextlib.contextmanager
+def frozen_statistics(module):
+    'stop batchnorm updating running statistics while a stage is recomputed'
+    norms = [m for m in module.modules() if isinstance(m, nn.BatchNorm2d)]
+    momentum = [m.momentum for m in norms]
+    for m in norms:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, value in zip(norms, momentum):
+            m.momentum = value
+
+
+class CheckpointSequential(nn.Sequential):
+
+    def __init__(self, sequential, stages, chosen):
+        'same children (and state_dict) as sequential, split into stages'
+        super().__init__(*sequential)
+        self.stages = stages
+        self.chosen = set(chosen)
+
+    def forward(self, x):
+        recompute = self.training and torch.is_grad_enabled()
+        modules = list(self)
+        for i, (start, end) in enumerate(self.stages):
+            stage = nn.Sequential(*modules[start:end])
+            if recompute and i in self.chosen:
+                contexts = lambda: (contextlib.nullcontext(),
+                                    frozen_statistics(stage))
+                x = checkpoint(stage, x, use_reentrant=False,
+                               context_fn=contexts)
+            else:
+                x = stage(x)
+        return x
+
+
+def _checkpoint_side(module, prefix, stages, chosen):
+    'wrap the chosen stages of one encoder or decoder'
+    if hasattr(module, f'{prefix}1'):
+        for i in chosen:
+            name = f'{prefix}{i + 1}'
+            stage = getattr(module, name)
+            setattr(module, name, CheckpointSequential(stage, [(0, len(stage))], [0]))
+    elif chosen:
+        sequential = getattr(module, prefix)
+        setattr(module, prefix, CheckpointSequential(sequential, stages, chosen))
+
+
+def checkpoint_stages(model, names):
+    'enable checkpointing on stages named encoder1..encoder5, decoder1..decoder5'
+    names = set(names)
+    valid = {f'{p}{i}' for p in ['encoder', 'decoder'] for i in range(1, 6)}
+    if not names <= valid:
+        raise ValueError(f'unknown stages {sorted(names - valid)}')
+    for prefix, stages in [('encoder', ENCODER_STAGES), ('decoder', DECODER_STAGES)]:
+        chosen = sorted(int(n[-1]) - 1 for n in names if n.startswith(prefix))
+        _checkpoint_side(getattr(model, prefix), prefix, stages, chosen)
+    return model
+
+
+def saved_bytes(step):
+    'bytes autograd keeps alive between the forward and backward of step()'
+    total = [0]
+
+    def pack(tensor):
+        total[0] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        loss = step()
+    loss.backward()
+    return total[0]
+
+
+def report(model, step, configurations, repeats=3):
+    'time a training step and measure stored activations per configuration'
+    results = []
+    for names in configurations:
+        candidate = checkpoint_stages(copy.deepcopy(model).train(), names)
+        saved = saved_bytes(lambda: step(candidate))
+        start = time.time()
+        for _ in range(repeats):
+            step(candidate).backward()
+        elapsed = (time.time() - start) / repeats
+        results.append((names, saved, elapsed))
+        label = ','.join(names) if len(names) < 3 else f'{len(names)} stages'
+        print(f"{label or 'none':<20} "
+              f"{saved / 2 ** 20:9.1f} MiB {elapsed * 1000:9.1f} ms")
+    return results
+
+
+if __name__ == '__main__':
+    from residual import Autoencoder
+
+    batch_size = 64
+    data = torch.rand(batch_size, 3, 32, 32) * 2 - 1
+    step = lambda model: nn.functional.mse_loss(model(data), data)
+    encoder = [f'encoder{i}' for i in range(1, 6)]
+    decoder = [f'decoder{i}' for i in range(1, 6)]
+    configurations = [[]] + [[n] for n in encoder + decoder] + [encoder + decoder]
+    report(Autoencoder(), step, configurations)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+"""
+compress images into quantised, arithmetic coded latents and back
+"""
+import argparse
+import importlib
+import io
+import itertools
+import math
+import os
+import struct
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision.io import read_image, ImageReadMode
+from torchvision.utils import save_image
+
+from tiling import encode_tiles, decode_tiles, positions
+
+
+MAGIC = b'AEC1'
+VERSION = 2
+HEADER = struct.Struct('<4sBHHfHHHH')
+FRAME = struct.Struct('<HHI')
+
+PRECISION = 32
+# frequency tables sum to at most this, well inside a quarter of the range
+TOTAL = 1 << 16
+FULL = 1 << PRECISION
+HALF = FULL >> 1
+QUARTER = FULL >> 2
+MASK = FULL - 1
+
+
+class FrequencyTable:
+
+    def __init__(self, frequencies):
+        'fixed symbol frequencies, looked up through their cumulative sums'
+        self.cumulative = np.concatenate([[0], np.cumsum(frequencies)]).astype(np.int64)
+        self.total = int(self.cumulative[-1])
+
+    @classmethod
+    def laplace(cls, location, scale, step, levels):
+        'a laplace prior discretised onto the 2 * levels + 1 quantisation bins, none empty'
+        scale = max(float(scale), step / 16)
+        middles = (np.arange(2 * levels) - levels + 0.5) * step - float(location)
+        below = 0.5 * np.exp(np.minimum(middles, 0) / scale)
+        cdf = np.where(middles < 0, below, 1 - 0.5 * np.exp(-np.maximum(middles, 0) / scale))
+        probabilities = np.diff(np.concatenate([[0], cdf, [1]]))
+        symbols = 2 * levels + 1
+        return cls(1 + np.floor(probabilities * (TOTAL - symbols)).astype(np.int64))
+
+    def interval(self, symbol):
+        return int(self.cumulative[symbol]), int(self.cumulative[symbol + 1])
+
+    def find(self, value):
+        'the symbol whose interval holds value, with its interval'
+        symbol = int(np.searchsorted(self.cumulative, value, side='right')) - 1
+        return (symbol,) + self.interval(symbol)
+
+
+class ArithmeticEncoder:
+
+    def __init__(self):
+        self.low = 0
+        self.high = MASK
+        self.pending = 0
+        self.bits = []
+
+    def _emit(self, bit):
+        self.bits.append(bit)
+        self.bits.extend([1 - bit] * self.pending)
+        self.pending = 0
+
+    def encode(self, model, symbol):
+        low, high = model.interval(symbol)
+        span = self.high - self.low + 1
+        self.high = self.low + span * high // model.total - 1
+        self.low = self.low + span * low // model.total
+        while True:
+            if self.high < HALF:
+                self._emit(0)
+            elif self.low >= HALF:
+                self._emit(1)
+                self.low -= HALF
+                self.high -= HALF
+            elif self.low >= QUARTER and self.high < HALF + QUARTER:
+                self.pending += 1
+                self.low -= QUARTER
+                self.high -= QUARTER
+            else:
+                break
+            self.low = 2 * self.low
+            self.high = 2 * self.high + 1
+
+    def finish(self):
+        'bytes of everything encoded so far'
+        self.pending += 1
+        self._emit(0 if self.low < QUARTER else 1)
+        return np.packbits(np.array(self.bits, dtype=np.uint8)).tobytes()
+
+
+class ArithmeticDecoder:
+
+    def __init__(self, data):
+        self.bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).tolist()
+        self.position = 0
+        self.low = 0
+        self.high = MASK
+        self.code = 0
+        for _ in range(PRECISION):
+            self.code = 2 * self.code + self._bit()
+
+    def _bit(self):
+        bit = self.bits[self.position] if self.position < len(self.bits) else 0
+        self.position += 1
+        return bit
+
+    def decode(self, model):
+        span = self.high - self.low + 1
+        value = ((self.code - self.low + 1) * model.total - 1) // span
+        symbol, low, high = model.find(value)
+        self.high = self.low + span * high // model.total - 1
+        self.low = self.low + span * low // model.total
+        while True:
+            if self.high < HALF:
+                pass
+            elif self.low >= HALF:
+                self.low -= HALF
+                self.high -= HALF
+                self.code -= HALF
+            elif self.low >= QUARTER and self.high < HALF + QUARTER:
+                self.low -= QUARTER
+                self.high -= QUARTER
+                self.code -= QUARTER
+            else:
+                break
+            self.low = 2 * self.low
+            self.high = 2 * self.high + 1
+            self.code = 2 * self.code + self._bit()
+        return symbol
+
+
+def quantise(latents, step, levels):
+    'integer symbols in [0, 2 * levels]'
+    symbols = torch.round(latents / step).clamp(-levels, levels) + levels
+    return symbols.to(torch.int64)
+
+
+def dequantise(symbols, step, levels):
+    return (symbols.float() - levels) * step
+
+
+@torch.no_grad()
+def fit_prior(encoder, batches):
+    '(channels, 2) laplace location and scale of every latent channel over batches of tiles'
+    device = next(encoder.parameters()).device
+    latents = torch.cat([encoder(tiles.to(device)).cpu() for tiles in batches])
+    latents = latents.transpose(0, 1).flatten(1)
+    location = latents.median(1).values
+    scale = (latents - location.unsqueeze(1)).abs().mean(1)
+    return torch.stack([location, scale], 1).numpy().astype(np.float32)
+
+
+def tables(prior, step, levels):
+    return [FrequencyTable.laplace(location, scale, step, levels) for location, scale in prior]
+
+
+class Writer:
+
+    def __init__(self, stream, tile, overlap, step, levels, shape, prior):
+        '''
+        container header, then the prior; shape is the (channels, height, width)
+        of one tile latent and prior the fit_prior of its channels
+        '''
+        self.stream = stream
+        self.step = step
+        self.levels = levels
+        self.tile = tile
+        self.overlap = overlap
+        prior = np.asarray(prior, dtype='<f4').reshape(shape[0], 2)
+        # the decoder rebuilds its tables from the values as stored, not from prior
+        prior = np.frombuffer(prior.tobytes(), dtype='<f4').reshape(-1, 2)
+        self.models = tables(prior, step, levels)
+        stream.write(HEADER.pack(MAGIC, VERSION, tile, overlap, step, levels, *shape))
+        stream.write(prior.tobytes())
+
+    def write(self, height, width, latents):
+        'one frame: image size, then latents coded with the per channel tables'
+        symbols = quantise(latents, self.step, self.levels).cpu()
+        coder = ArithmeticEncoder()
+        for row in symbols.permute(0, 2, 3, 1).reshape(-1, symbols.size(1)).tolist():
+            for model, symbol in zip(self.models, row):
+                coder.encode(model, symbol)
+        payload = coder.finish()
+        self.stream.write(FRAME.pack(height, width, len(payload)))
+        self.stream.write(payload)
+        return FRAME.size + len(payload)
+
+
+class Reader:
+
+    def __init__(self, stream):
+        self.stream = stream
+        magic, version, self.tile, self.overlap, self.step, self.levels, *shape = \
+            HEADER.unpack(stream.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not an autoencoder codec stream')
+        self.shape = tuple(shape)
+        prior = np.frombuffer(stream.read(8 * shape[0]), dtype='<f4').reshape(-1, 2)
+        self.models = tables(prior, self.step, self.levels)
+
+    def __iter__(self):
+        'height, width and latents of every frame, read as they arrive'
+        while True:
+            head = self.stream.read(FRAME.size)
+            if len(head) < FRAME.size:
+                return
+            height, width, length = FRAME.unpack(head)
+            decoder = ArithmeticDecoder(self.stream.read(length))
+            padded = (max(height, self.tile), max(width, self.tile))
+            tiles = len(positions(*padded, self.tile, self.overlap))
+            channels, rows, columns = self.shape
+            symbols = [decoder.decode(model)
+                       for _ in range(tiles * rows * columns) for model in self.models]
+            symbols = torch.tensor(symbols).view(tiles, rows, columns, channels)
+            yield height, width, dequantise(symbols.permute(0, 3, 1, 2), self.step, self.levels)
+
+
+def compress(encoder, images, stream, prior, tile=32, overlap=0, step=0.05, levels=127):
+    'write (channels, height, width) images in [-1, 1] as frames; returns bytes written'
+    device = next(encoder.parameters()).device
+    shape = encoder(torch.zeros(1, images[0].size(0), tile, tile, device=device)).shape[1:]
+    writer = Writer(stream, tile, overlap, step, levels, shape, prior)
+    written = HEADER.size + 8 * shape[0]
+    for image in images:
+        latents = encode_tiles(encoder, image, tile, overlap)
+        written += writer.write(*image.shape[1:], latents)
+    return written
+
+
+def decompress(decoder, stream, channels=3):
+    'images in [-1, 1], one per frame'
+    device = next(decoder.parameters()).device
+    reader = Reader(stream)
+    for height, width, latents in reader:
+        yield decode_tiles(decoder, latents.to(device), (channels, height, width),
+                           reader.tile, reader.overlap)
+
+
+def psnr(image, reference):
+    'in decibels, for images in [-1, 1]'
+    mse = F.mse_loss((image + 1) / 2, (reference + 1) / 2).item()
+    return 10 * math.log10(1 / max(mse, 1e-10))
+
+
+def benchmark(model, images, prior, step, levels):
+    'bits per pixel, psnr and throughput of a round trip through the codec'
+    stream = io.BytesIO()
+    start = time.perf_counter()
+    written = compress(model.encoder, images, stream, prior, step=step, levels=levels)
+    encoding = time.perf_counter() - start
+    stream.seek(0)
+    start = time.perf_counter()
+    outputs = list(decompress(model.decoder, stream))
+    decoding = time.perf_counter() - start
+    pixels = sum(image[0].numel() for image in images)
+    quality = sum(psnr(o, i) for o, i in zip(outputs, images)) / len(images)
+    print(f'step {step:g}: {8 * written / pixels:.4f} bpp  {quality:.2f} dB PSNR  '
+          f'encode {len(images) / encoding:.1f} images/s  '
+          f'decode {len(images) / decoding:.1f} images/s')
+
+
+def load_model(script, weights, device):
+    model = importlib.import_module(script).Autoencoder().to(device)
+    model.load_state_dict(torch.load(weights, map_location=device))
+    return model.eval()
+
+
+def training_prior(encoder, count):
+    'fit_prior over the first count cifar10 training images'
+    from dataloaders import get_cifar10
+    train_loader = get_cifar10('data', False, 500, 1000)[0]
+    batches = itertools.islice(train_loader, -(-count // train_loader.batch_size))
+    return fit_prior(encoder, (data for data, _ in batches))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='learned image codec')
+    parser.add_argument('command', choices=['prior', 'compress', 'decompress', 'benchmark'])
+    parser.add_argument('script', help='script defining the Autoencoder, e.g. residual')
+    parser.add_argument('weights', help='its saved state_dict, e.g. residual_cifar/10.pt')
+    parser.add_argument('inputs', nargs='*',
+                        help='images to compress, or the stream to decompress (- for stdin)')
+    parser.add_argument('--output', default='-',
+                        help='stream to write, or folder for decompressed images')
+    parser.add_argument('--prior', default=None,
+                        help='a .npy the prior command wrote; otherwise fit one for compress')
+    parser.add_argument('--prior-images', type=int, default=5000,
+                        help='cifar10 training images the prior is fitted on')
+    parser.add_argument('--step', type=float, nargs='+', default=[0.05],
+                        help='quantisation step; benchmark takes several')
+    parser.add_argument('--levels', type=int, default=127,
+                        help='symbols either side of zero')
+    parser.add_argument('--overlap', type=int, default=0)
+    parser.add_argument('--images', type=int, default=200,
+                        help='cifar10 test images to benchmark on')
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model(args.script, args.weights, device)
+    with torch.inference_mode():
+        if args.command in ('prior', 'compress', 'benchmark'):
+            if args.prior is not None:
+                prior = np.load(args.prior)
+            else:
+                prior = training_prior(model.encoder, args.prior_images)
+        if args.command == 'prior':
+            np.save('prior.npy' if args.output == '-' else args.output, prior)
+        elif args.command == 'compress':
+            # the same normalisation get_cifar10 applies
+            images = [read_image(p, ImageReadMode.RGB).float() / 255 * 2 - 1
+                      for p in args.inputs]
+            stream = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+            compress(model.encoder, images, stream, prior, overlap=args.overlap,
+                     step=args.step[0], levels=args.levels)
+            stream.flush()
+        elif args.command == 'decompress':
+            path = args.inputs[0] if args.inputs else '-'
+            stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+            folder = '.' if args.output == '-' else args.output
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            for i, image in enumerate(decompress(model.decoder, stream)):
+                save_image((image.cpu() + 1) / 2, f'{folder}/{i}.png')
+        else:
+            from dataloaders import get_cifar10
+            test_loader = get_cifar10('data', False, 64, args.images)[1]
+            images = list(next(iter(test_loader))[0])
+            for step in args.step:
+                benchmark(model, images, prior, step, args.levels)
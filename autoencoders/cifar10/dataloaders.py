@@ -5,31 +5,46 @@ download mnist
 import torch.utils.data
 from torchvision import datasets, transforms
 
+from ring import RingLoader
 
-def get_mnist(path, use_cuda, batch_size, test_batch_size):
+
+def make_loader(dataset, batch_size, shuffle=True, ring=0, **kwargs):
+    'DataLoader, or with ring > 0 a shared memory ring of that many slots'
+    if ring:
+        workers = kwargs.get('num_workers') or 1
+        # every worker owns the same number of slots
+        ring = -(-ring // workers) * workers
+        return RingLoader(dataset, batch_size, shuffle, workers, ring)
+    return torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, **kwargs)
+
+
+def get_mnist(path, use_cuda, batch_size, test_batch_size, loader=None):
     'download into folder data if folder does not exist, then create dataloader'
     kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    kwargs = kwargs if loader is None else loader
 
     t = transforms.Compose([
         transforms.ToTensor(),
         transforms.Normalize((0.1307,), (0.3081,))
         ])
 
-    train_loader = torch.utils.data.DataLoader(
+    train_loader = make_loader(
         datasets.MNIST(path, train=True, download=True, transform=t),
         batch_size=batch_size, shuffle=True, **kwargs
     )
 
-    test_loader = torch.utils.data.DataLoader(
+    test_loader = make_loader(
         datasets.MNIST(path, train=False, download=True, transform=t),
         batch_size=test_batch_size, shuffle=True, **kwargs
     )
     return train_loader, test_loader
 
 
-def get_2d_mnist(path, use_cuda, batch_size, test_batch_size):
+def get_2d_mnist(path, use_cuda, batch_size, test_batch_size, loader=None):
     'download into folder data if folder does not exist, then create dataloader'
     kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    kwargs = kwargs if loader is None else loader
 
     t = transforms.Compose([
         transforms.Resize((28, 28)),
@@ -37,32 +52,33 @@ def get_2d_mnist(path, use_cuda, batch_size, test_batch_size):
         transforms.Normalize((0.1307,), (0.3081,))
         ])
 
-    train_loader = torch.utils.data.DataLoader(
+    train_loader = make_loader(
         datasets.MNIST(path, train=True, download=True, transform=t),
         batch_size=batch_size, shuffle=True, **kwargs
     )
 
-    test_loader = torch.utils.data.DataLoader(
+    test_loader = make_loader(
         datasets.MNIST(path, train=False, download=True, transform=t),
         batch_size=test_batch_size, shuffle=True, **kwargs
     )
     return train_loader, test_loader
 
 
-def get_cifar10(path, use_cuda, batch_size, test_batch_size):
+def get_cifar10(path, use_cuda, batch_size, test_batch_size, loader=None):
     'download into folder data if folder does not exist, then create dataloader'
     kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    kwargs = kwargs if loader is None else loader
     t = transforms.Compose([
         transforms.ToTensor(),
         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
     ])
 
-    train_loader = torch.utils.data.DataLoader(
+    train_loader = make_loader(
         datasets.CIFAR10(path, train=True, download=True, transform=t),
         batch_size=batch_size, shuffle=True, **kwargs
     )
 
-    test_loader = torch.utils.data.DataLoader(
+    test_loader = make_loader(
         datasets.CIFAR10(path, train=False, download=True, transform=t),
         batch_size=test_batch_size, shuffle=True, **kwargs
     )
@@ -7,11 +7,17 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import os
-from tqdm.autonotebook import tqdm
+from telemetry import Telemetry
 from torchvision.utils import save_image
 
 from residual import Autoencoder, BasicBlock, ELU_BatchNorm2d
 from dataloaders import *
+from fuse import fuse
+from background import BackgroundEvaluator, ScriptEvaluation
+from store import Store, ScriptStore, script_config
+from profiling import LayerProfiler, layers
+from checkpoint import checkpoint_stages
+from tuning import load_settings, set_threads
 
 torch.manual_seed(9001)
 
@@ -68,36 +74,39 @@ class PerceptualLoss(nn.Module):
         return loss
 
 
-def train(model, device, train_loader, optimizer, epoch, loss):
-    progress = tqdm(enumerate(train_loader), desc="train", total=len(train_loader))
+def train(model, device, train_loader, optimizer, epoch, loss, profiler=None):
+    telemetry = Telemetry("train", len(train_loader), epoch)
     model.train()
     train_loss = 0
-    for i, (data, _) in progress:
-        data = data.to(device)
+    for i, (data, _) in enumerate(telemetry.wrap(train_loader)):
+        if profiler is not None:
+            profiler.step()
+        data = telemetry.to(device, data)
         optimizer.zero_grad()
         output = model(data)
         batch_loss = loss.compute(output, data)
         batch_loss.backward()
         optimizer.step()
         train_loss += batch_loss
-        progress.set_description("train loss: {:.4f}".format(train_loss/(i+1)))
+        telemetry.update(data.size(0), loss=train_loss/(i+1))
+    return float(train_loss / (i+1))
 
 
 def test(model, device, test_loader, folder, epoch, loss):
-    progress = tqdm(enumerate(test_loader), desc="test", total=len(test_loader))
+    telemetry = Telemetry("test", len(test_loader), epoch)
     model.eval()
     test_loss = 0
     with torch.no_grad():
-        for i, (data, _) in progress:
-            data = data.to(device)
+        for i, (data, _) in enumerate(telemetry.wrap(test_loader)):
+            data = telemetry.to(device, data)
             output = model(data)
             test_loss += loss.compute(output, data)
-            progress.set_description("test loss: {:.4f}".format(test_loss/(i+1)))
+            telemetry.update(data.size(0), loss=test_loss/(i+1))
             if i == 0:
-                output = output.view(100, 3, 32, 32)
-                data = data.view(100, 3, 32, 32)
+                output = output.view(data.shape)
                 save_image(output.cpu(), f'{folder}/{epoch}.png', nrow=10)
                 save_image(data.cpu(), f'{folder}/{epoch}baseline.png', nrow=10)
+    return float(test_loss / (i+1))
 
 
 
@@ -106,26 +115,74 @@ def main():
     test_batch_size = 100
     epochs = 20
     save_model = True
+    profile = 0  # training steps of per-layer profiling, 0 to disable
+    checkpoint = []  # stages to recompute in backward, e.g. ['encoder2']
+    tuned = None  # e.g. 'tuned.json' written by tuning.py
+    store = None  # e.g. Store('store', max_age=30, max_size=2**30)
+    background = False  # test snapshots in another process while training continues
     folder = 'perceptual'
 
     if not os.path.exists(folder):
         os.makedirs(folder)
 
+    settings = load_settings(tuned, 'train_perceptual')
+    if settings is not None:
+        batch_size = settings['batch_size']
+        set_threads(settings)
+
     use_cuda = torch.cuda.is_available()
     device = torch.device("cuda" if use_cuda else "cpu")
     model = Autoencoder().to(device)
+    checkpoint_stages(model, checkpoint)
     optimizer = optim.Adam(model.parameters())
+    profiler = LayerProfiler(layers(model), profile) if profile else None
     loss = PerceptualLoss(device)
 
     path = 'data'
     train_loader, test_loader = get_cifar10(path, use_cuda, batch_size, test_batch_size)
 
-    for epoch in range(1, epochs + 1):
+    start, experiment = 0, None
+    if store is not None:
+        config = script_config('perceptual', model, train_loader, test_loader,
+                               seed=9001, batch_size=batch_size,
+                               test_batch_size=test_batch_size)
+        experiment = ScriptStore(store, config, folder)
+        start = experiment.resume(model, optimizer, epochs)
+
+    evaluator = None
+    if background:
+        job = ScriptEvaluation('perceptual', folder, test_batch_size,
+                               extras=('PerceptualLoss',))
+        evaluator = BackgroundEvaluator(job, [model])
+
+    for epoch in range(start + 1, epochs + 1):
         print(f"\n{epoch}")
-        train(model, device, train_loader, optimizer, epoch, loss)
-        test(model, device, test_loader, folder, epoch, loss)
+        train_loss = train(model, device, train_loader, optimizer, epoch, loss,
+                           profiler=profiler)
+        if profiler is not None:
+            profiler.close()
         if save_model:
             torch.save(model.state_dict(), f"{folder}/{epoch}.pt")
+        if experiment is not None:
+            experiment.trained(epoch, model, optimizer, train_loss)
+        if evaluator is None:
+            test_loss = test(fuse(model), device, test_loader, folder, epoch, loss)
+            if experiment is not None:
+                experiment.tested(epoch, test_loss)
+        else:
+            evaluator.submit(epoch, [model])
+            for finished, test_loss in evaluator.poll():
+                print(f'test (epoch {finished}): {test_loss:.4f}')
+                if experiment is not None:
+                    experiment.tested(finished, test_loss)
+
+    if evaluator is not None:
+        for finished, test_loss in evaluator.close():
+            print(f'test (epoch {finished}): {test_loss:.4f}')
+            if experiment is not None:
+                experiment.tested(finished, test_loss)
+    if store is not None:
+        store.evict()
 
 
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+time, count flops and measure activations of every layer for a window of steps
+"""
+import threading
+import time
+import warnings
+import torch
+import torch.nn as nn
+from torch.profiler import profile, ProfilerActivity
+
+
+def layers(model):
+    '''
+    every position of the sequentials directly under model.encoder and model.decoder;
+    a module used at several positions, like a shared activation, is listed at each
+    '''
+    found = {}
+    for side in ['encoder', 'decoder']:
+        for name, stage in getattr(model, side).named_children():
+            if isinstance(stage, nn.Sequential):
+                for index, layer in enumerate(stage):
+                    found[f'{side}.{name}.{index}'] = layer
+    return found
+
+
+def flops(module, inputs, output):
+    'multiply-adds of the forward pass of one leaf module, counted as two flops'
+    if isinstance(module, nn.Linear):
+        return 2 * output.numel() * module.in_features
+    if isinstance(module, nn.ConvTranspose2d):
+        kernel = module.weight[0].numel()
+        return 2 * inputs[0].numel() * kernel
+    if isinstance(module, nn.Conv2d):
+        kernel = module.weight[0].numel()
+        return 2 * output.numel() * kernel
+    return 0
+
+
+def _synchronise(tensor):
+    if isinstance(tensor, torch.Tensor) and tensor.is_cuda:
+        torch.cuda.synchronize(tensor.device)
+
+
+class Record:
+
+    def __init__(self, module):
+        self.kind = type(module).__name__
+        self.calls = 0
+        self.forward = 0.0
+        self.backward = 0.0
+        self.flops = 0
+        self.bytes = 0
+        self.started = None
+
+
+class LayerProfiler:
+
+    def __init__(self, modules, steps, start=10, trace='trace.json'):
+        'profile modules (name -> module) for steps steps after start steps'
+        self.modules = modules
+        self.steps = steps
+        self.start = start
+        self.trace = trace
+        self.count = 0
+        self.profiled = 0
+        self.handles = []
+        self.profiler = None
+        self.records = {name: Record(m) for name, m in modules.items()}
+
+    def _attach(self):
+        # a module at several positions runs once per position and pass: forward
+        # calls go to its positions in order, backward calls in reverse
+        shared = {}
+        for name, module in self.modules.items():
+            shared.setdefault(id(module), (module, []))[1].append(self.records[name])
+        # what is running nests per thread, with --workers training runs side by side
+        local = threading.local()
+
+        def running():
+            if not hasattr(local, 'running'):
+                local.running = []
+            return local.running
+
+        def count(leaf, inputs, output):
+            if running():
+                running()[-1].flops += flops(leaf, inputs, output)
+
+        leaves = {id(leaf): leaf for module, _ in shared.values()
+                  for leaf in module.modules() if not list(leaf.children())}
+        # before the timing hooks, so a profiled leaf counts while it is running
+        self.handles += [leaf.register_forward_hook(count) for leaf in leaves.values()]
+
+        for module, records in shared.values():
+            calls = {'forward': 0, 'backward': 0, 'current': None}
+
+            def pre(module, inputs, records=records, calls=calls):
+                _synchronise(inputs[0] if inputs else None)
+                record = records[calls['forward'] % len(records)]
+                calls['forward'] += 1
+                running().append(record)
+                record.started = time.perf_counter()
+
+            def post(module, inputs, output):
+                _synchronise(output)
+                record = running().pop()
+                record.forward += time.perf_counter() - record.started
+                record.calls += 1
+                if isinstance(output, torch.Tensor):
+                    record.bytes += output.numel() * output.element_size()
+
+            def backward_pre(module, grad_output, records=records, calls=calls):
+                _synchronise(grad_output[0])
+                record = records[-1 - calls['backward'] % len(records)]
+                calls['backward'] += 1
+                calls['current'] = record
+                record.started = time.perf_counter()
+
+            def backward(module, grad_input, grad_output, calls=calls):
+                _synchronise(grad_output[0])
+                record = calls['current']
+                record.backward += time.perf_counter() - record.started
+
+            self.handles += [
+                module.register_forward_pre_hook(pre),
+                module.register_forward_hook(post),
+                module.register_full_backward_pre_hook(backward_pre),
+                module.register_full_backward_hook(backward),
+            ]
+        # the first layer gets no input gradient, so its backward hook fires as soon
+        # as its output gradient is known and torch warns about it every step
+        self.warnings = warnings.catch_warnings()
+        self.warnings.__enter__()
+        warnings.filterwarnings('ignore', 'Full backward hook is firing', UserWarning)
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.profiler = profile(activities=activities, record_shapes=True)
+        self.profiler.__enter__()
+
+    def _detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.profiler.__exit__(None, None, None)
+        self.warnings.__exit__(None, None, None)
+        self.profiler.export_chrome_trace(self.trace)
+        self.profiler = None
+        print(self.table())
+        print(f'chrome trace written to {self.trace}')
+
+    def step(self):
+        'call once before every training step'
+        if self.count == self.start:
+            self._attach()
+        elif self.count == self.start + self.steps and self.profiler is not None:
+            self._detach()
+        if self.profiler is not None:
+            self.profiled += 1
+        self.count += 1
+
+    def close(self):
+        '''
+        call at the end of every training epoch: a window still open finishes
+        there, before the hooks can see a test pass
+        '''
+        if self.profiler is not None:
+            self._detach()
+
+    def table(self):
+        '''
+        per layer averages over the profiled steps; a layer whose input needs no
+        gradient, like the first, shows no backward time
+        '''
+        lines = [f"{'layer':<24}{'type':<18}{'fwd ms':>9}{'bwd ms':>9}"
+                 f"{'MFLOP':>10}{'act KiB':>10}"]
+        for name, r in self.records.items():
+            steps = max(self.profiled, 1)
+            lines.append(f'{name:<24}{r.kind:<18}'
+                         f'{1000 * r.forward / steps:9.3f}'
+                         f'{1000 * r.backward / steps:9.3f}'
+                         f'{r.flops / steps / 1e6:10.2f}'
+                         f'{r.bytes / steps / 2 ** 10:10.1f}')
+        return '\n'.join(lines)
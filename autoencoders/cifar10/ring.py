@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+loader whose workers write batches straight into a shared memory ring of slots
+"""
+import torch
+import torch.multiprocessing as mp
+
+
+def _work(dataset, tasks, data, labels, sizes, free, filled):
+    'fill the slot of every batch handed over until told to stop'
+    slots = len(free)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        batch, indices = task
+        slot = batch % slots
+        free[slot].acquire()
+        for j, index in enumerate(indices):
+            image, label = dataset[index]
+            data[slot, j].copy_(image)
+            labels[slot, j] = label
+        sizes[slot] = len(indices)
+        filled[slot].release()
+
+
+class RingLoader:
+
+    def __init__(self, dataset, batch_size, shuffle=True, workers=2, slots=8,
+                 drop_last=False):
+        'batches are views into the ring, valid until the next one is requested'
+        if slots % workers != 0:
+            raise ValueError(f'{slots} slots cannot be shared evenly by {workers} workers')
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        image, label = dataset[0]
+        label = torch.as_tensor(label)
+        self.data = torch.empty(slots, batch_size, *image.shape, dtype=image.dtype)
+        self.labels = torch.empty(slots, batch_size, *label.shape, dtype=label.dtype)
+        self.sizes = torch.zeros(slots, dtype=torch.long)
+        for tensor in [self.data, self.labels, self.sizes]:
+            tensor.share_memory_()
+        # batch b goes into slot b % slots, filled by the one worker owning that
+        # slot, slot % workers, in the order it was handed its batches: workers
+        # wait for free, the trainer for filled, so batches arrive in order and
+        # at most slots are ahead
+        self.free = [mp.Semaphore(1) for _ in range(slots)]
+        self.filled = [mp.Semaphore(0) for _ in range(slots)]
+        self.tasks = [mp.Queue() for _ in range(workers)]
+        self.workers = []
+        for tasks in self.tasks:
+            worker = mp.Process(target=_work, daemon=True, args=(
+                dataset, tasks, self.data, self.labels, self.sizes,
+                self.free, self.filled))
+            worker.start()
+            self.workers.append(worker)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return -(-len(self.dataset) // self.batch_size)
+
+    def _batches(self):
+        if self.shuffle:
+            order = torch.randperm(len(self.dataset))
+        else:
+            order = torch.arange(len(self.dataset))
+        return [order[i:i + self.batch_size].tolist()
+                for i in range(0, len(self) * self.batch_size, self.batch_size)]
+
+    def _wait(self, slot):
+        while not self.filled[slot].acquire(timeout=5):
+            if not all(w.is_alive() for w in self.workers):
+                raise RuntimeError('ring loader worker exited unexpectedly')
+
+    def __iter__(self):
+        batches = self._batches()
+        slots = len(self.free)
+        for b, indices in enumerate(batches):
+            self.tasks[b % slots % len(self.tasks)].put((b, indices))
+        consumed = 0
+        try:
+            for b in range(len(batches)):
+                slot = b % slots
+                self._wait(slot)
+                size = int(self.sizes[slot])
+                yield self.data[slot, :size], self.labels[slot, :size]
+                self.free[slot].release()
+                consumed += 1
+        finally:
+            # stopped early: let the remaining batches land and recycle them
+            for b in range(consumed, len(batches)):
+                slot = b % slots
+                if b > consumed:
+                    self._wait(slot)
+                self.free[slot].release()
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def __del__(self):
+        if getattr(self, 'workers', None):
+            self.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+run an encoder and decoder over images of any size in overlapping tiles
+"""
+import argparse
+import importlib
+import torch
+import torch.nn.functional as F
+from torchvision.io import read_image, ImageReadMode
+from torchvision.utils import save_image
+
+
+def starts(length, tile, overlap):
+    'tile offsets covering length, the last one flush with the end'
+    if not 0 <= overlap < tile:
+        raise ValueError(f'overlap {overlap} must be at least 0 and less than tile {tile}')
+    stride = tile - overlap
+    offsets = list(range(0, max(length - tile, 0) + 1, stride))
+    if offsets[-1] + tile < length:
+        offsets.append(length - tile)
+    return offsets
+
+
+def window(tile, overlap, device=None):
+    'weights ramping up across the overlap so neighbouring tiles cross fade'
+    ramp = torch.ones(tile, device=device)
+    if overlap > 0:
+        edge = torch.arange(1, overlap + 1, device=device) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge.flip(0)
+    return ramp.view(tile, 1) * ramp.view(1, tile)
+
+
+def positions(height, width, tile, overlap):
+    return [(y, x) for y in starts(height, tile, overlap)
+            for x in starts(width, tile, overlap)]
+
+
+def _pad(image, tile):
+    'zero pad images smaller than one tile; returns the padded image'
+    height, width = image.shape[-2:]
+    return F.pad(image, (0, max(tile - width, 0), 0, max(tile - height, 0)))
+
+
+def _chunks(image, places, tile, batch):
+    for i in range(0, len(places), batch):
+        chunk = places[i:i + batch]
+        yield chunk, torch.stack([image[:, y:y + tile, x:x + tile] for y, x in chunk])
+
+
+def _paste(canvas, weights, places, outputs, blend):
+    tile = blend.size(0)
+    for (y, x), output in zip(places, outputs):
+        canvas[:, y:y + tile, x:x + tile] += output * blend
+        weights[:, y:y + tile, x:x + tile] += blend
+
+
+def encode_tiles(encoder, image, tile=32, overlap=8, batch=64):
+    'latents of every tile of one (channels, height, width) image, in raster order'
+    device = next(encoder.parameters()).device
+    image = _pad(image, tile)
+    places = positions(*image.shape[-2:], tile, overlap)
+    latents = [encoder(tiles.to(device)) for _, tiles in _chunks(image, places, tile, batch)]
+    return torch.cat(latents)
+
+
+def decode_tiles(decoder, latents, shape, tile=32, overlap=8, batch=64):
+    'blend the decoded tiles of encode_tiles back into one image of shape'
+    device = latents.device
+    channels, height, width = shape
+    padded = (max(height, tile), max(width, tile))
+    canvas = torch.zeros(channels, *padded, device=device)
+    weights = torch.zeros(1, *padded, device=device)
+    blend = window(tile, overlap, device)
+    places = positions(*padded, tile, overlap)
+    for i in range(0, len(places), batch):
+        outputs = decoder(latents[i:i + batch]).view(-1, channels, tile, tile)
+        _paste(canvas, weights, places[i:i + batch], outputs, blend)
+    return (canvas / weights)[:, :height, :width]
+
+
+def tiled(encoder, decoder, image, tile=32, overlap=8, batch=64):
+    'reconstruct one image, holding at most batch tiles on the device at once'
+    device = next(encoder.parameters()).device
+    channels, height, width = image.shape
+    padded = _pad(image, tile)
+    canvas = torch.zeros(padded.shape, device=device)
+    weights = torch.zeros(1, *padded.shape[1:], device=device)
+    blend = window(tile, overlap, device)
+    places = positions(*padded.shape[1:], tile, overlap)
+    for chunk, tiles in _chunks(padded, places, tile, batch):
+        outputs = decoder(encoder(tiles.to(device))).view(tiles.shape)
+        _paste(canvas, weights, chunk, outputs, blend)
+    return (canvas / weights)[:, :height, :width]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='reconstruct a large image tile by tile')
+    parser.add_argument('script', help='script defining the Autoencoder, e.g. residual')
+    parser.add_argument('weights', help='its saved state_dict, e.g. residual_cifar/10.pt')
+    parser.add_argument('image')
+    parser.add_argument('--output', default='tiled.png')
+    parser.add_argument('--tile', type=int, default=32)
+    parser.add_argument('--overlap', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=64,
+                        help='tiles on the device at once')
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = importlib.import_module(args.script).Autoencoder().to(device)
+    model.load_state_dict(torch.load(args.weights, map_location=device))
+    model.eval()
+    # the same normalisation get_cifar10 applies
+    image = read_image(args.image, ImageReadMode.RGB).float() / 255 * 2 - 1
+    with torch.inference_mode():
+        output = tiled(model.encoder, model.decoder, image,
+                       args.tile, args.overlap, args.batch)
+    save_image((output.cpu() + 1) / 2, args.output)
@@ -16,8 +16,12 @@ class Encoder(nn.Module):
 
 class Decoder(nn.Module):
 
-    def forward(self, x):
-        return self.main(x)
+    def forward(self, x, logits=False):
+        'probabilities, or with logits what goes into the final sigmoid'
+        x = self.main(x)
+        if logits:
+            return x
+        return self.sigmoid(x)
 
 
 class Autoencoder(nn.Module):
@@ -28,17 +32,18 @@ class Autoencoder(nn.Module):
         self.encoder = encoder
         self.decoder = decoder
 
-    def forward(self, x):
+    def forward(self, x, logits=False):
         'pass through encoder and decoder'
         x = self.encoder(x)
-        x = self.decoder(x)
+        x = self.decoder(x, logits)
         return x
 
     def run_one_batch(self, data, optimiser=None, labels=None):
-        output = self(data)
+        'returns logits: apply a sigmoid to see images'
+        output = self(data, logits=True)
         datasize = data.size(0)
         data = data.reshape(output.shape)
-        loss = F.binary_cross_entropy(output, data, reduction='sum') / datasize
+        loss = F.binary_cross_entropy_with_logits(output, data, reduction='sum') / datasize
         if optimiser is not None:
             optimiser.zero_grad()
             loss.backward()
@@ -0,0 +1,84 @@
+"""
+evaluate snapshots of the training weights in another process while training goes on
+"""
+import queue
+import torch
+import torch.multiprocessing as mp
+
+import telemetry
+
+
+def _serve(job, shared, free, requests, results, settings):
+    'load each snapshot, hand the shared memory back, then evaluate it'
+    telemetry.configure(**settings)
+    models = job.build()
+    while True:
+        epoch = requests.get()
+        if epoch is None:
+            return
+        for model, state in zip(models, shared):
+            model.load_state_dict(state)
+        free.release()
+        results.put((epoch, job(models, epoch)))
+
+
+class BackgroundEvaluator:
+
+    def __init__(self, job, modules):
+        '''
+        job.build() makes models shaped like modules in the evaluator process;
+        job(models, epoch) evaluates them there and returns picklable metrics
+        '''
+        ctx = mp.get_context('spawn')
+        self.shared = [{k: v.detach().to('cpu', copy=True).share_memory_()
+                        for k, v in m.state_dict().items()} for m in modules]
+        # one snapshot in flight: the next waits until the evaluator copied it out
+        self.free = ctx.Semaphore(1)
+        self.requests = ctx.Queue()
+        self.results = ctx.Queue()
+        # the evaluator neither draws progress bars nor rewrites the prometheus file
+        settings = {**telemetry.settings, 'console': False, 'prometheus': None}
+        self.process = ctx.Process(
+            target=_serve, daemon=True,
+            args=(job, self.shared, self.free, self.requests, self.results, settings))
+        self.process.start()
+        self.pending = 0
+
+    def _check(self):
+        if not self.process.is_alive():
+            raise RuntimeError(f'background evaluator exited with code {self.process.exitcode}')
+
+    @torch.no_grad()
+    def submit(self, epoch, modules):
+        'snapshot the weights of modules for epoch; training carries on at once'
+        while not self.free.acquire(timeout=1):
+            self._check()
+        for model, state in zip(modules, self.shared):
+            for k, v in model.state_dict().items():
+                state[k].copy_(v)
+        self.requests.put(epoch)
+        self.pending += 1
+
+    def poll(self, block=False):
+        '(epoch, metrics) of every finished evaluation, waiting for one if block'
+        finished = []
+        while self.pending > 0:
+            try:
+                wait = block and not finished
+                finished.append(self.results.get(block=wait, timeout=1 if wait else None))
+            except queue.Empty:
+                if not wait:
+                    break
+                self._check()
+                continue
+            self.pending -= 1
+        return finished
+
+    def close(self):
+        'wait for the outstanding evaluations; returns their results'
+        finished = []
+        while self.pending > 0:
+            finished += self.poll(block=True)
+        self.requests.put(None)
+        self.process.join()
+        return finished
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+binarized mnist kept as packed bits, 98 bytes per image
+"""
+import time
+import numpy as np
+import torch
+from torchvision import datasets, transforms
+
+
+PIXELS = 28 * 28
+SHIFTS = torch.arange(7, -1, -1, dtype=torch.uint8)
+
+
+def unpack(packed):
+    'rows of packed bytes to float images of 0s and 1s, on packed.device'
+    bits = (packed.unsqueeze(-1) >> SHIFTS.to(packed.device)) & 1
+    return bits.view(-1, PIXELS).float().view(-1, 1, 28, 28)
+
+
+class BinarizedMNIST:
+
+    def __init__(self, path, train=True, dynamic=False, seed=0):
+        'threshold at one half, or with dynamic sample each pixel from its intensity'
+        mnist = datasets.MNIST(path, train=train, download=True)
+        self.targets = mnist.targets
+        self.dynamic = dynamic
+        self.generator = torch.Generator().manual_seed(seed)
+        # the grey levels are only needed to draw new binarizations
+        self.grey = mnist.data.view(-1, PIXELS) if dynamic else None
+        if dynamic:
+            self.rebinarize()
+        else:
+            self.data = self._pack(mnist.data.view(-1, PIXELS) > 127)
+
+    def _pack(self, bits):
+        return torch.from_numpy(np.packbits(bits.numpy(), axis=1))
+
+    def rebinarize(self):
+        'draw a fresh binarization of every image'
+        probabilities = self.grey.float() / 255
+        self.data = self._pack(torch.bernoulli(probabilities, generator=self.generator) > 0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return unpack(self.data[index])[0], int(self.targets[index])
+
+
+class PackedLoader:
+
+    def __init__(self, dataset, batch_size, shuffle=True, device='cpu', rebinarize=False):
+        'gathers packed rows, moves them to device and unpacks the whole batch there'
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.device = torch.device(device)
+        self.rebinarize = rebinarize
+        # the draw the dataset made when it was built serves the first epoch
+        self.drawn = True
+
+    def __len__(self):
+        return -(-len(self.dataset) // self.batch_size)
+
+    def state(self):
+        'what drawing the binarizations an uninterrupted run would draw takes'
+        return self.dataset.generator.get_state()
+
+    def restore(self, state):
+        'carry on from state, drawing afresh for the next epoch'
+        self.dataset.generator.set_state(state)
+        self.drawn = False
+
+    def __iter__(self):
+        if self.rebinarize and not self.drawn:
+            self.dataset.rebinarize()
+        self.drawn = False
+        n = len(self.dataset)
+        order = torch.randperm(n) if self.shuffle else torch.arange(n)
+        for i in range(0, n, self.batch_size):
+            indices = order[i:i + self.batch_size]
+            packed = self.dataset.data[indices].to(self.device, non_blocking=True)
+            labels = self.dataset.targets[indices].to(self.device, non_blocking=True)
+            yield unpack(packed), labels
+
+
+def get_binarized_mnist(path, use_cuda, batch_size, test_batch_size, dynamic=False):
+    'packed train and test sets; dynamic redraws the training set every epoch'
+    device = 'cuda' if use_cuda else 'cpu'
+    train = BinarizedMNIST(path, train=True, dynamic=dynamic)
+    # the test set is binarized once so every epoch is scored on the same images
+    test = BinarizedMNIST(path, train=False, dynamic=dynamic)
+    train_loader = PackedLoader(train, batch_size, True, device, rebinarize=dynamic)
+    test_loader = PackedLoader(test, test_batch_size, True, device)
+    return train_loader, test_loader
+
+
+def benchmark(path, batch_size=64):
+    'bytes held and images per second against the float tensor pipeline'
+    threshold = transforms.Compose([transforms.ToTensor(), lambda x: (x > 0.5).float()])
+    tensors = torch.utils.data.DataLoader(
+        datasets.MNIST(path, train=True, download=True, transform=threshold),
+        batch_size=batch_size, shuffle=True)
+    packed = PackedLoader(BinarizedMNIST(path), batch_size)
+    floats = len(tensors.dataset) * PIXELS * 4
+    print(f'float32 images: {floats / 2 ** 20:8.1f} MiB')
+    print(f'packed bits:    {packed.dataset.data.numel() / 2 ** 20:8.1f} MiB')
+    for name, loader in [('transform', tensors), ('packed', packed)]:
+        start = time.perf_counter()
+        images = sum(data.size(0) for data, _ in loader)
+        print(f'{name:<10}{images / (time.perf_counter() - start):10.0f} images/s')
+
+
+if __name__ == '__main__':
+    benchmark('../../data')
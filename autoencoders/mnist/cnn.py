@@ -38,6 +38,7 @@ class CNN_Decoder(Decoder):
     def __init__(self, filters=[4, 8, 16, 32], bottleneck=10):
         super().__init__()
         self.activate = nn.ELU()
+        self.sigmoid = nn.Sigmoid()
         self.main = nn.Sequential(
             nn.Conv2d(bottleneck, filters[-1], 1, 1),
             self.activate,
@@ -57,6 +58,5 @@ class CNN_Decoder(Decoder):
             nn.ConvTranspose2d(filters[-3], filters[-4], 5, 2, output_padding=1),
             self.activate,
             nn.BatchNorm2d(filters[-4]),
-            nn.Conv2d(filters[-4], 1, 3, 1, padding=1),
-            nn.Sigmoid()
+            nn.Conv2d(filters[-4], 1, 3, 1, padding=1)
         )
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+download mnist
+"""
+import torch.utils.data
+from torchvision import datasets, transforms
+
+from ring import RingLoader
+from binarized import get_binarized_mnist
+
+
+def make_loader(dataset, batch_size, shuffle=True, ring=0, **kwargs):
+    'DataLoader, or with ring > 0 a shared memory ring of that many slots'
+    if ring:
+        workers = kwargs.get('num_workers') or 1
+        # every worker owns the same number of slots
+        ring = -(-ring // workers) * workers
+        return RingLoader(dataset, batch_size, shuffle, workers, ring)
+    return torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, **kwargs)
+
+
+def get_mnist(path, use_cuda, batch_size, test_batch_size, loader=None, binarize=None):
+    'download into folder data if folder does not exist, then create dataloader'
+    if binarize is not None:
+        dynamic = {'static': False, 'dynamic': True}[binarize]
+        return get_binarized_mnist(path, use_cuda, batch_size, test_batch_size, dynamic)
+    kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    kwargs = kwargs if loader is None else loader
+
+    # pixels stay in [0, 1]: they are the targets of binary cross entropy
+    t = transforms.ToTensor()
+
+    train_loader = make_loader(
+        datasets.MNIST(path, train=True, download=True, transform=t),
+        batch_size=batch_size, shuffle=True, **kwargs
+    )
+
+    # a ring only pays off for the training set, read again every epoch
+    test_kwargs = {k: v for k, v in kwargs.items() if k != 'ring'}
+    test_loader = make_loader(
+        datasets.MNIST(path, train=False, download=True, transform=t),
+        batch_size=test_batch_size, shuffle=True, **test_kwargs
+    )
+    return train_loader, test_loader
+
+
+if __name__ == '__main__':
+    use_cuda = torch.cuda.is_available()
+    path = '../../data'
+    get_mnist(path, use_cuda, 64, 1000)
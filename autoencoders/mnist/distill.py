@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+distil a frozen teacher into cheaper registry encoder and decoder pairs
+"""
+import argparse
+import time
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+
+from models import models, losses, build
+from dataloaders import get_mnist
+from fuse import fuse
+from variational import VAE
+
+
+parser = argparse.ArgumentParser(description='distil a teacher into smaller students')
+parser.add_argument('--teacher', default='res',
+                    help='registry architecture of the teacher')
+parser.add_argument('--teacher-loss', default='ae',
+                    help='what loss the teacher was trained with')
+parser.add_argument('--weights', required=True,
+                    help='the teacher state_dict, as main.py --save-model writes it')
+parser.add_argument('--bits', type=int, default=64, metavar='N',
+                    help='hash code width of a hash teacher, as main.py --bits (default: 64)')
+parser.add_argument('--students', default=['fnn', 'cnn'], nargs='+',
+                    help='registry architectures to distil into')
+parser.add_argument('--alpha', type=float, default=100.0,
+                    help='weight of matching the teacher latents')
+parser.add_argument('--batch-size', type=int, default=64, metavar='N',
+                    help='input batch size for training (default: 64)')
+parser.add_argument('--test-batch-size', type=int, default=1000, metavar='N',
+                    help='input batch size for testing (default: 1000)')
+parser.add_argument('--epochs', type=int, default=10, metavar='N',
+                    help='number of epochs to train (default: 10)')
+parser.add_argument('--save-model', action='store_true', default=False,
+                    help='save a state_dict per student')
+
+
+def teach(teacher, data):
+    'flattened latents and reconstruction logits of the teacher'
+    if isinstance(teacher, VAE):
+        # one pass each: decode the mean rather than a sample
+        latents, _ = teacher.encoder(data, variational=True)
+        output = teacher.decoder(latents, logits=True)
+    else:
+        # caught on the way through the forward pass rather than encoded again
+        seen = []
+        handle = teacher.encoder.register_forward_hook(lambda m, i, o: seen.append(o))
+        try:
+            output = teacher(data, logits=True)
+        finally:
+            handle.remove()
+        latents = seen[0]
+    return latents.flatten(1), output.flatten(1)
+
+
+@torch.inference_mode()
+def cache(teacher, dataset, batch_size, device):
+    'images with the teacher outputs for them, computed once for every epoch'
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+    images, latents, outputs = [], [], []
+    for data, _ in loader:
+        latent, output = teach(teacher, data.to(device))
+        images.append(data)
+        latents.append(latent.cpu())
+        # logits only set soft targets: half precision halves the cache
+        outputs.append(output.half().cpu())
+    return torch.utils.data.TensorDataset(
+        torch.cat(images), torch.cat(latents), torch.cat(outputs))
+
+
+def distil_loss(student, data, latents, outputs, alpha):
+    'match the teacher latents and its reconstruction probabilities'
+    z = student.encoder(data)
+    output = student.decoder(z, logits=True).flatten(1)
+    targets = torch.sigmoid(outputs.float())
+    loss = F.binary_cross_entropy_with_logits(output, targets, reduction='sum')
+    loss = loss + alpha * F.mse_loss(z.flatten(1), latents, reduction='sum')
+    return loss / data.size(0)
+
+
+def run_one_epoch(students, optimisers, dataloader, alpha, device):
+    'one pass of the cached teacher outputs through every student'
+    total = [0] * len(students)
+    for student in students:
+        student.train()
+    for i, (data, latents, outputs) in enumerate(dataloader):
+        data, latents, outputs = data.to(device), latents.to(device), outputs.to(device)
+        for j, (student, optimiser) in enumerate(zip(students, optimisers)):
+            loss = distil_loss(student, data, latents, outputs, alpha)
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
+            total[j] += loss.detach()
+    return [t / (i + 1) for t in total]
+
+
+def _latency(function, data, repeats=10):
+    'milliseconds per batch'
+    function(data)
+    if data.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(data)
+    if data.is_cuda:
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+@torch.inference_mode()
+def report(named, teacher, test_loader, device):
+    'latency against quality of every model, the teacher first'
+    print(f"\n{'model':>10} {'params':>8} {'encode ms':>10} {'decode ms':>10} "
+          f"{'bce':>9} {'latent mse':>11} {'cosine':>7}")
+    for name, model in named:
+        model = fuse(model)
+        bce = mse = cosine = 0
+        for i, (data, _) in enumerate(test_loader):
+            data = data.to(device)
+            latents, _ = teach(teacher, data)
+            z = model.encoder(data)
+            output = model.decoder(z, logits=True).flatten(1)
+            bce += F.binary_cross_entropy_with_logits(
+                output, data.flatten(1), reduction='sum').item() / data.size(0)
+            mse += F.mse_loss(z.flatten(1), latents, reduction='sum').item() / data.size(0)
+            cosine += F.cosine_similarity(z.flatten(1), latents).mean().item()
+        encode = _latency(model.encoder, data)
+        decode = _latency(model.decoder, z)
+        params = sum(p.numel() for p in model.parameters())
+        n = i + 1
+        print(f'{name:>10} {params:8d} {encode:10.3f} {decode:10.3f} '
+              f'{bce / n:9.2f} {mse / n:11.4f} {cosine / n:7.4f}')
+
+
+def main():
+    args = parser.parse_args()
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    path = '../../data'
+    train_loader, test_loader = get_mnist(
+        path, use_cuda, args.batch_size, args.test_batch_size)
+
+    teacher = build(args.teacher, args.teacher_loss, bits=args.bits).to(device)
+    teacher.load_state_dict(torch.load(args.weights, map_location=device))
+    # students encode to as many channels as the teacher, to match its latents
+    width = teacher.encoder.mean.weight.size(0)
+    teacher = fuse(teacher)
+
+    start = time.perf_counter()
+    cached = cache(teacher, train_loader.dataset, args.test_batch_size, device)
+    print(f'cached {len(cached)} teacher outputs in {time.perf_counter() - start:.1f} s')
+    kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    dataloader = torch.utils.data.DataLoader(
+        cached, batch_size=args.batch_size, shuffle=True, **kwargs)
+
+    students = [losses['ae'](*[m(bottleneck=width) for m in models[name]]).to(device)
+                for name in args.students]
+    optimisers = [optim.Adam(s.parameters()) for s in students]
+    for epoch in range(1, args.epochs + 1):
+        train = run_one_epoch(students, optimisers, dataloader, args.alpha, device)
+        print(f'{epoch} ' + '  '.join(f'{name}: {loss:.4f}'
+                                      for name, loss in zip(args.students, train)))
+
+    named = [(f'{args.teacher_loss}_{args.teacher}', teacher)]
+    named += [(f'distil_{name}', s) for name, s in zip(args.students, students)]
+    report(named, teacher, test_loader, device)
+
+    if args.save_model:
+        for name, student in zip(args.students, students):
+            torch.save(student.state_dict(), f'distil_{name}_{args.epochs}.pt')
+
+
+if __name__ == '__main__':
+    main()
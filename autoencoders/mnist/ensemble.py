@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+train many copies of one registry model at once, one per (beta, seed) pair
+"""
+import argparse
+import copy
+import itertools
+import os
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.func import functional_call, stack_module_state, vmap
+
+from models import models, losses
+from variational import variational_loss
+from dataloaders import get_mnist
+
+
+parser = argparse.ArgumentParser(description='vectorised sweep over betas and seeds')
+parser.add_argument('--model', default='fnn',
+                    help='what model architecture to use')
+parser.add_argument('--loss', default='vae',
+                    help='ae or vae; the other losses are not vectorised')
+parser.add_argument('--betas', type=float, nargs='+', default=[500.0],
+                    help='weights of the divergence term, one member each')
+parser.add_argument('--seeds', type=int, nargs='+', default=[1],
+                    help='initialisation seeds, one member each')
+parser.add_argument('--batch-size', type=int, default=64, metavar='N',
+                    help='input batch size for training (default: 64)')
+parser.add_argument('--test-batch-size', type=int, default=100, metavar='N',
+                    help='input batch size for testing (default: 100)')
+parser.add_argument('--epochs', type=int, default=10, metavar='N',
+                    help='number of epochs to train (default: 10)')
+parser.add_argument('--save-model', action='store_true', default=False,
+                    help='save a state_dict per member')
+
+
+class Ensemble:
+
+    def __init__(self, model, loss, betas, seeds, device):
+        'stack one freshly initialised model per (beta, seed) pair'
+        if loss not in ['ae', 'vae']:
+            raise ValueError(f'cannot vectorise loss {loss}')
+        self.members = list(itertools.product(betas, seeds))
+        copies = []
+        for beta, seed in self.members:
+            torch.manual_seed(seed)
+            encoder, decoder = models[model][0](), models[model][1]()
+            copies.append(losses[loss](encoder, decoder).to(device))
+        self.params, self.buffers = stack_module_state(copies)
+        self.base = copy.deepcopy(copies[0]).to('meta')
+        self.betas = torch.tensor([b for b, _ in self.members], device=device)
+
+    def __len__(self):
+        return len(self.members)
+
+    def parameters(self):
+        return self.params.values()
+
+    def member_loss(self, params, buffers, beta, data):
+        'loss of a single member, written as if there were no ensemble'
+        output = functional_call(self.base, (params, buffers), (data,), {'logits': True})
+        if isinstance(output, tuple):
+            output, mean, logvar = output
+            target = data.reshape(output.shape)
+            loss = variational_loss(output, target, mean, logvar, beta, logits=True)
+        else:
+            target = data.reshape(output.shape)
+            loss = F.binary_cross_entropy_with_logits(output, target, reduction='sum')
+        return loss / data.size(0)
+
+    def run_one_batch(self, data, optimiser=None):
+        'per-member losses of one batch shared by every member'
+        self.base.train(optimiser is not None)
+        batched = vmap(self.member_loss, in_dims=(0, 0, 0, None),
+                       randomness='different')
+        loss = batched(self.params, self.buffers, self.betas, data)
+        if optimiser is not None:
+            optimiser.zero_grad()
+            loss.sum().backward()
+            optimiser.step()
+        return loss.detach()
+
+    def state_dict(self, i):
+        'unstack the weights of member i into an ordinary state_dict'
+        state = {k: v[i].detach().clone() for k, v in self.params.items()}
+        state.update({k: v[i].clone() for k, v in self.buffers.items()})
+        return state
+
+
+def run_one_epoch(ensemble, dataloader, optimiser=None):
+    'mean loss of every member over the dataloader'
+    device = ensemble.betas.device
+    total = torch.zeros(len(ensemble), device=device)
+    with torch.set_grad_enabled(optimiser is not None):
+        for i, (data, _) in enumerate(dataloader):
+            total += ensemble.run_one_batch(data.to(device), optimiser)
+    return total / (i + 1)
+
+
+def main():
+    args = parser.parse_args()
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+    folder = f'images/{args.loss}_{args.model}_ensemble'
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    path = '../../data'
+    train_loader, test_loader = get_mnist(
+        path, use_cuda, args.batch_size, args.test_batch_size)
+    ensemble = Ensemble(args.model, args.loss, args.betas, args.seeds, device)
+    # adam is elementwise, so one optimiser over stacked weights is exactly
+    # one independent optimiser per member
+    optimiser = optim.Adam(ensemble.parameters())
+
+    for epoch in range(1, args.epochs + 1):
+        print(f'\n{epoch}')
+        train = run_one_epoch(ensemble, train_loader, optimiser)
+        test = run_one_epoch(ensemble, test_loader)
+        for i, (beta, seed) in enumerate(ensemble.members):
+            print(f'beta {beta:g} seed {seed}: '
+                  f'train {train[i]:.4f} test {test[i]:.4f}')
+
+    if args.save_model:
+        for i, (beta, seed) in enumerate(ensemble.members):
+            name = f'{folder}/{epoch}_beta{beta:g}_seed{seed}.pt'
+            torch.save(ensemble.state_dict(i), name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+a fixed, decoded once test set and evaluation that stops when the loss is known well enough
+"""
+import hashlib
+import math
+import os
+import time
+import torch
+
+from store import fingerprint
+
+
+def materialise(dataset, folder=None, seed=0):
+    '''
+    every image and label of dataset as two tensors in a fixed shuffled order,
+    kept in folder so the transforms only ever run once
+    '''
+    path = None
+    if folder is not None:
+        # the transform decides the tensors as much as the images do
+        key = fingerprint(dataset) + repr(getattr(dataset, 'transform', None))
+        key = hashlib.sha1(key.encode()).hexdigest()
+        path = f'{folder}/test_{key[:16]}_{seed}.pt'
+        if os.path.exists(path):
+            return torch.load(path)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=1000)
+    images, labels = [torch.cat(t) for t in zip(*loader)]
+    # shuffled once, so any prefix is a fair sample for early stopping
+    order = torch.randperm(len(images), generator=torch.Generator().manual_seed(seed))
+    images, labels = images[order].contiguous(), labels[order].contiguous()
+    if path is not None:
+        os.makedirs(folder, exist_ok=True)
+        torch.save((images, labels), f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+    return images, labels
+
+
+class TensorLoader:
+
+    def __init__(self, dataset, images, labels, batch_size, device='cpu'):
+        'the same batches in the same order every epoch, already on device'
+        # dataset stays the original, for fingerprints and traversals
+        self.dataset = dataset
+        self.images = images.to(device)
+        self.labels = labels.to(device)
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return -(-len(self.images) // self.batch_size)
+
+    def __iter__(self):
+        for i in range(0, len(self.images), self.batch_size):
+            yield self.images[i:i + self.batch_size], self.labels[i:i + self.batch_size]
+
+
+def _out_of_memory(error):
+    message = str(error)
+    return 'out of memory' in message or "can't allocate" in message
+
+
+@torch.inference_mode()
+def largest_batch(models, images, start=100, limit=4096):
+    'double the batch from start while every model still fits, up to limit'
+    batch, fits = start, None
+    while batch <= min(limit, len(images)):
+        try:
+            for model in models:
+                model.run_one_batch(images[:batch])
+        except (RuntimeError, MemoryError) as error:
+            if not _out_of_memory(error):
+                raise
+            break
+        finally:
+            if images.is_cuda:
+                torch.cuda.empty_cache()
+        fits = batch
+        batch *= 2
+    if fits is None:
+        raise RuntimeError(f'not even a batch of {start} fits')
+    return fits
+
+
+class ConfidenceStop:
+
+    def __init__(self, tolerance, minimum=5, z=1.96):
+        '''
+        done once the confidence interval of every mean loss is within
+        tolerance of the mean, relative, after at least minimum batches
+        '''
+        self.tolerance = tolerance
+        self.minimum = minimum
+        self.z = z
+        self.count = 0
+        self.sums = None
+        self.squares = None
+
+    def update(self, losses):
+        'losses: the mean loss of one batch for every model; returns True when done'
+        losses = [float(loss) for loss in losses]
+        if self.sums is None:
+            self.sums = [0.0] * len(losses)
+            self.squares = [0.0] * len(losses)
+        self.count += 1
+        for i, loss in enumerate(losses):
+            self.sums[i] += loss
+            self.squares[i] += loss * loss
+        return self.count >= self.minimum and all(
+            self.half_width(i) <= self.tolerance * abs(self.sums[i] / self.count)
+            for i in range(len(losses)))
+
+    def half_width(self, i):
+        n = self.count
+        mean = self.sums[i] / n
+        variance = max(self.squares[i] / n - mean * mean, 0) * n / max(n - 1, 1)
+        return self.z * math.sqrt(variance / n)
+
+
+if __name__ == '__main__':
+    from torchvision import datasets, transforms
+    from models import models, losses
+
+    dataset = datasets.MNIST('../../data', train=False, download=True,
+                             transform=transforms.ToTensor())
+    start = time.perf_counter()
+    for _ in torch.utils.data.DataLoader(dataset, batch_size=100, shuffle=True):
+        pass
+    decoding = time.perf_counter() - start
+    images, labels = materialise(dataset)
+    loader = TensorLoader(dataset, images, labels, 100)
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    print(f'one pass: PIL transforms {1000 * decoding:.1f} ms, '
+          f'cached tensors {1000 * (time.perf_counter() - start):.1f} ms')
+
+    model = losses['ae'](*[m() for m in models['cnn']]).eval()
+    batch = largest_batch([model], images)
+    for size in sorted({100, batch}):
+        start = time.perf_counter()
+        with torch.inference_mode():
+            for data, _ in TensorLoader(dataset, images, labels, size):
+                model.run_one_batch(data)
+        print(f'batch {size:5d}: {1000 * (time.perf_counter() - start):.1f} ms')
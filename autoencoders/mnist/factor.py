@@ -1,48 +1,126 @@
+import time
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from variational import VAE, variational_loss
+import torch.optim as optim
+from torch.func import functional_call
+from variational import VAE
 # this is really good
 # https://github.com/1Konny/FactorVAE/blob/master/solver.py
 
-def disc_one_batch(model, data, target):
-    logits = model(data)
-    output = F.log_softmax(logits, dim=1)
-    loss = F.nll_loss(output, target)
-    pred = output.argmax(dim=1, keepdim=True)
-    return pred, loss
+
+def permute_dims(z):
+    'shuffle every latent dimension independently across the batch'
+    z = z.flatten(1)
+    order = torch.rand(z.shape, device=z.device).argsort(0)
+    return torch.gather(z, 0, order)
+
+
+def disc_one_batch(model, z):
+    'discriminator loss: latents of the batch are 0, permuted latents are 1'
+    z = z.detach()
+    logits = torch.cat([model(z), model(permute_dims(z))])
+    zeros = torch.zeros(z.size(0), dtype=torch.long, device=z.device)
+    target = torch.cat([zeros, torch.ones_like(zeros)])
+    return F.cross_entropy(logits, target)
 
 
 class Discrimator(nn.Module):
 
-    def __init__(self):
+    def __init__(self, bottleneck=10, width=256):
         super().__init__()
-        self.fnn = nn.Linear(10, 10, bias=False)
+        self.fnn = nn.Sequential(
+            nn.Linear(bottleneck, width),
+            nn.LeakyReLU(0.2),
+            nn.Linear(width, width),
+            nn.LeakyReLU(0.2),
+            nn.Linear(width, 2)
+        )
 
     def forward(self, x):
-        return self.fnn(x)
+        return self.fnn(x.flatten(1))
 
 
 class Factor_VAE(VAE):
 
-    def __init__(self, encoder, decoder):
-        'define encoder and decoder'
-        super().__init__(encoder, decoder)
-        self.disc = Discrimator()
+    def __init__(self, encoder, decoder, samples=1, gamma=10):
+        'define encoder, decoder and a total correlation discriminator'
+        super().__init__(encoder, decoder, samples)
+        self.gamma = gamma
+        # one discriminator input per latent channel the encoder produces
+        self.disc = Discrimator(encoder.mean.weight.size(0))
 
-    def run_one_batch(self, data, optimiser=None, labels=None):
-        output, mean, logvar = self(data)
-        mean2, logvar2 = mean.clone(), logvar.clone()
-        datasize = data.size(0)
-        data = data.reshape(output.shape)
-        loss = variational_loss(output, data, mean, logvar) / datasize
+    def total_correlation(self, z):
+        'density ratio estimate, passed through the discriminator as a constant'
+        weights = {k: v.detach() for k, v in self.disc.named_parameters()}
+        logits = functional_call(self.disc, weights, (z,))
+        return (logits[:, 0] - logits[:, 1]).mean()
 
-        middle = self.repameterise(mean2, logvar2)
-        pred, disc_loss = disc_one_batch(self.disc, middle, labels)
-        loss += disc_loss
+    def run_one_batch(self, data, optimiser=None, labels=None, disc_optimiser=None):
+        '''
+        one encoder pass feeds the vae update and, given disc_optimiser, the
+        discriminator update
+        '''
+        output, objective, loss, middle = self.bound(data)
+        penalty = self.gamma * self.total_correlation(middle)
+        loss = loss / data.size(0) + penalty.detach()
 
         if optimiser is not None:
             optimiser.zero_grad()
-            loss.backward()
+            (objective / data.size(0) + penalty).backward()
             optimiser.step()
+        if disc_optimiser is not None:
+            disc_optimiser.zero_grad()
+            disc_one_batch(self.disc, middle).backward()
+            disc_optimiser.step()
         return output, loss
+
+
+def optimisers(model):
+    '''
+    run_one_batch keywords for training model: adam over everything outside
+    the discriminator, and the discriminator's own adam if model has one
+    '''
+    disc = getattr(model, 'disc', None)
+    if disc is None:
+        return {'optimiser': optim.Adam(model.parameters())}
+    skip = {id(p) for p in disc.parameters()}
+    return {
+        'optimiser': optim.Adam([p for p in model.parameters() if id(p) not in skip]),
+        'disc_optimiser': optim.Adam(disc.parameters(), lr=1e-4, betas=(0.5, 0.9)),
+    }
+
+
+def two_passes(model, data, optimiser, disc_optimiser):
+    'the same updates, encoding the batch a second time for the discriminator'
+    output, objective, loss, middle = model.bound(data)
+    penalty = model.gamma * model.total_correlation(middle)
+    loss = loss / data.size(0) + penalty.detach()
+    optimiser.zero_grad()
+    (objective / data.size(0) + penalty).backward()
+    optimiser.step()
+    with torch.no_grad():
+        mean, logvar = model.encoder(data, variational=True)
+        middle = model.repameterise(mean, logvar)
+    disc_optimiser.zero_grad()
+    disc_one_batch(model.disc, middle).backward()
+    disc_optimiser.step()
+    return output, loss
+
+
+if __name__ == '__main__':
+    from models import models
+    data = torch.rand(64, 1, 28, 28).bernoulli()
+    for name in ['fnn', 'cnn']:
+        model = Factor_VAE(models[name][0](), models[name][1]())
+        trainers = optimisers(model)
+        times = {}
+        for passes, step in [('shared', lambda: model.run_one_batch(data, **trainers)),
+                             ('two', lambda: two_passes(model, data, **trainers))]:
+            step()
+            start = time.perf_counter()
+            for _ in range(10):
+                step()
+            times[passes] = 100 * (time.perf_counter() - start)
+        print(f"{name}: shared encoder {times['shared']:6.2f} ms"
+              f"  two passes {times['two']:6.2f} ms")
@@ -14,7 +14,7 @@ class Flatten(nn.Module):
 
 class FNN_Encoder(Encoder):
 
-    def __init__(self):
+    def __init__(self, bottleneck=bottleneck):
         super().__init__()
         self.activate = nn.ELU()
         self.main = nn.Sequential(
@@ -28,12 +28,12 @@ class FNN_Encoder(Encoder):
 
 class FNN_Decoder(Decoder):
 
-    def __init__(self):
+    def __init__(self, bottleneck=bottleneck):
         super().__init__()
         self.activate = nn.ELU()
+        self.sigmoid = nn.Sigmoid()
         self.main = nn.Sequential(
             nn.Linear(bottleneck, 64, bias=False),
             self.activate,
-            nn.Linear(64, 784),
-            nn.Sigmoid()
+            nn.Linear(64, 784)
         )
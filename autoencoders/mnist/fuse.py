@@ -0,0 +1,120 @@
+import copy
+import torch
+import torch.nn as nn
+
+
+def _tail(module):
+    'return the batchnorm a module finishes with, if any'
+    if isinstance(module, nn.BatchNorm2d):
+        return module
+    if isinstance(module, nn.Sequential) and len(module) > 0:
+        return _tail(module[-1])
+    if hasattr(module, 'actnorm'):
+        return _tail(module.actnorm)
+    return None
+
+
+def _head(module):
+    'return the convolution a module starts with, if any'
+    if isinstance(module, nn.Conv2d):
+        return module
+    if isinstance(module, nn.Sequential) and len(module) > 0:
+        return _head(module[0])
+    return None
+
+
+def _replace(parent, bn):
+    'swap a batchnorm for an identity wherever it sits below parent'
+    for name, child in parent.named_children():
+        if child is bn:
+            setattr(parent, name, nn.Identity())
+            return True
+        if _replace(child, bn):
+            return True
+    return False
+
+
+def _affine(bn):
+    'batchnorm in eval mode is y = scale * x + shift'
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    return scale, shift
+
+
+def fold_into_previous(conv, bn):
+    'conv followed by bn: scale output channels of the conv'
+    scale, shift = _affine(bn)
+    if isinstance(conv, nn.ConvTranspose2d):
+        shape = (1, -1) + (1,) * (conv.weight.dim() - 2)
+    else:
+        shape = (-1,) + (1,) * (conv.weight.dim() - 1)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(shift)
+    conv.weight.copy_(conv.weight * scale.view(shape))
+    conv.bias = nn.Parameter(bias * scale + shift)
+
+
+def fold_into_next(bn, conv):
+    'bn followed by an unpadded conv: scale input channels of the conv'
+    scale, shift = _affine(bn)
+    weight = conv.weight
+    bias = conv.bias if conv.bias is not None else torch.zeros(
+        weight.shape[0], device=weight.device, dtype=weight.dtype)
+    bias = bias + (weight * shift.view(1, -1, 1, 1)).sum(dim=(1, 2, 3))
+    conv.weight.copy_(weight * scale.view(1, -1, 1, 1))
+    conv.bias = nn.Parameter(bias)
+
+
+def _foldable_next(conv):
+    'constant shifts only survive convolutions that never see padding'
+    return (type(conv) is nn.Conv2d and conv.groups == 1
+            and conv.padding_mode == 'zeros'
+            and all(p == 0 for p in conv.padding))
+
+
+def _foldable(bn):
+    return bn is not None and bn.affine and bn.track_running_stats
+
+
+def _fold(parent, folded):
+    'fold every batchnorm that is adjacent to a convolution inside parent'
+    if isinstance(parent, nn.Sequential):
+        # iterate rather than children(), which skips a reused activation
+        children = list(parent)
+        for previous, following in zip(children, children[1:]):
+            if isinstance(previous, (nn.Conv2d, nn.ConvTranspose2d)) \
+                    and isinstance(following, nn.BatchNorm2d) \
+                    and previous.groups == 1 and _foldable(following) \
+                    and following not in folded:
+                fold_into_previous(previous, following)
+                folded.add(following)
+                continue
+            bn, conv = _tail(previous), _head(following)
+            if _foldable(bn) and bn not in folded \
+                    and conv is not None and _foldable_next(conv):
+                fold_into_next(bn, conv)
+                folded.add(bn)
+    for child in parent.children():
+        _fold(child, folded)
+
+
+def _has_conv(model):
+    return any(isinstance(m, (nn.Conv2d, nn.ConvTranspose2d))
+               for m in model.modules())
+
+
+@torch.no_grad()
+def fuse(model, channels_last=None):
+    'return a frozen copy of model with batchnorms folded into convolutions'
+    model = copy.deepcopy(model).eval()
+    folded = set()
+    _fold(model, folded)
+    for bn in folded:
+        _replace(model, bn)
+    model.folded = len(folded)
+    if channels_last is None:
+        channels_last = _has_conv(model)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    for p in model.parameters():
+        p.requires_grad_(False)
+    return model
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+pack binary codes into uint64 words and search them by hamming distance
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+
+# popcount of every byte, for numpy without bitwise_count
+_BYTES = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(1)
+
+
+def popcount(words):
+    'set bits of every uint64'
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _BYTES[words.view(np.uint8)].reshape(*words.shape, 8).sum(-1)
+
+
+def pack(bits):
+    'rows of booleans to rows of uint64 words, zero padded to whole words'
+    packed = np.packbits(np.asarray(bits, dtype=bool), axis=1)
+    padding = -packed.shape[1] % 8
+    packed = np.pad(packed, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def hamming_search(queries, database, k=10, chunk=64):
+    'indices and distances of the k closest packed codes to every packed query'
+    k = min(k, len(database))
+    # one contiguous row per word, so every xor streams through memory once
+    words = np.ascontiguousarray(database.T)
+    indices, distances = [], []
+    for start in range(0, len(queries), chunk):
+        part = queries[start:start + chunk]
+        distance = np.zeros((len(part), len(database)), dtype=np.int32)
+        for w, word in enumerate(words):
+            distance += popcount(part[:, w, None] ^ word)
+        closest = np.argpartition(distance, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(distance, closest, 1).argsort(1, kind='stable')
+        closest = np.take_along_axis(closest, order, 1)
+        indices.append(closest)
+        distances.append(np.take_along_axis(distance, closest, 1))
+    return np.concatenate(indices), np.concatenate(distances)
+
+
+def float_search(queries, database, k=10, chunk=256):
+    'indices of the k closest float latents by euclidean distance, brute force'
+    indices = []
+    for part in queries.split(chunk):
+        indices.append(torch.cdist(part, database).topk(k, largest=False).indices)
+    return torch.cat(indices).numpy()
+
+
+def benchmark(latents, queries=1000, k=10, shortlist=100):
+    'time sign bit hamming search against float search; recall of the shortlist'
+    queries, database = latents[:queries], latents[queries:]
+    start = time.perf_counter()
+    exact = float_search(queries, database, k)
+    floats = time.perf_counter() - start
+    packed_queries, packed_database = pack(queries > 0), pack(database > 0)
+    start = time.perf_counter()
+    found, _ = hamming_search(packed_queries, packed_database, shortlist)
+    hashed = time.perf_counter() - start
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(exact, found)])
+    print(f'{len(database)} codes of {latents.size(1)} dimensions: '
+          f'float {1000 * floats:.1f} ms ({database.numel() * 4 / 2 ** 20:.1f} MiB), '
+          f'hamming {1000 * hashed:.1f} ms ({packed_database.nbytes / 2 ** 20:.2f} MiB), '
+          f'float top {k} in hamming top {shortlist}: {recall:.3f}')
+
+
+if __name__ == '__main__':
+    from models import models, build
+    from dataloaders import get_mnist
+
+    parser = argparse.ArgumentParser(description='hamming against float retrieval')
+    parser.add_argument('--model', default='cnn', help='registry model, or a saved model file')
+    parser.add_argument('--bits', type=int, default=64,
+                        help='code width of a registry model (default: 64)')
+    parser.add_argument('--weights', default=None,
+                        help='state_dict of a registry model, as main.py --loss hash '
+                             '--save-model writes it; without it the codes are untrained')
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.model in models:
+        model = build(args.model, 'hash', bits=args.bits)
+        if args.weights is not None:
+            model.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    else:
+        model = torch.load(args.model, map_location='cpu', weights_only=False)
+    model.eval()
+    train_loader, _ = get_mnist('../../data', False, 1000, 1000)
+    with torch.inference_mode():
+        latents = torch.cat([model.encoder(data).flatten(1) for data, _ in train_loader])
+    benchmark(latents, args.queries)
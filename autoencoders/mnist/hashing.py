@@ -0,0 +1,30 @@
+import torch
+from autoencoder import Autoencoder
+from hamming import pack
+
+
+class Hashing_AE(Autoencoder):
+
+    def __init__(self, encoder, decoder):
+        '''
+        the decoder only sees the signs of the encoding, so the code has as
+        many bits as the encoder has latents: build both with a bottleneck of
+        64 or 128 for codes that separate near duplicates
+        '''
+        super().__init__(encoder, decoder)
+
+    def binarise(self, z):
+        'signs forward, the gradient of tanh backward'
+        z = torch.tanh(z)
+        return z + (torch.where(z >= 0, 1.0, -1.0) - z).detach()
+
+    def forward(self, x, logits=False):
+        'pass the binary code through the decoder'
+        x = self.binarise(self.encoder(x))
+        x = self.decoder(x, logits)
+        return x
+
+    def codes(self, x):
+        'hash codes of x packed into rows of uint64 words'
+        bits = self.encoder(x).flatten(1) >= 0
+        return pack(bits.cpu().numpy())
@@ -3,26 +3,45 @@ import random
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.optim as optim
+import copy
 import os
-from torchvision import datasets, transforms
-from tqdm.autonotebook import tqdm
+from concurrent.futures import ThreadPoolExecutor
 from torchvision.utils import save_image
 
-from models import models, losses
+from models import build
+from factor import optimisers
+from fuse import fuse
+from dataloaders import get_mnist
+from store import Store, fingerprint, code_version
+from profiling import LayerProfiler, layers
+from telemetry import Telemetry, configure
+from tuning import load_settings, set_threads
+from background import BackgroundEvaluator
+from evaluation import materialise, TensorLoader, largest_batch, ConfidenceStop
 
 
 parser = argparse.ArgumentParser(description='PyTorch MNIST Example')
-parser.add_argument('--model', default='fnn',
-                    help='what model architecture to use')
-parser.add_argument('--loss', default='ae',
-                    help='what loss function to train architecture')
+parser.add_argument('--model', default=['fnn'], nargs='+',
+                    help='what model architectures to use')
+parser.add_argument('--loss', default=['ae'], nargs='+',
+                    help='what loss functions to train each architecture with (ae, vae, factor, vq, hash, nested)')
+parser.add_argument('--samples', type=int, default=1, metavar='K',
+                    help='train vae and factor on the K sample importance weighted bound')
+parser.add_argument('--bits', type=int, default=64, metavar='N',
+                    help='hash code width: the bottleneck hash builds its models with (default: 64)')
+parser.add_argument('--prefixes', type=int, nargs='+', default=None, metavar='K',
+                    help='latent prefix lengths nested trains to reconstruct on their own')
 parser.add_argument('--traverse', action='store_false', default=True,
                     help='produce and image showing latent traversals')
 parser.add_argument('--batch-size', type=int, default=64, metavar='N',
                     help='input batch size for training (default: 64)')
 parser.add_argument('--test-batch-size', type=int, default=100, metavar='N',
                     help='input batch size for testing (default: 1000)')
+parser.add_argument('--eval-batch', type=int, default=0, metavar='N',
+                    help='test batch size, 0 for the largest that fits (default: 0)')
+parser.add_argument('--eval-tolerance', type=float, default=0, metavar='R',
+                    help='stop testing once every 95%% interval is within R of its mean '
+                         '(default: test every image)')
 parser.add_argument('--epochs', type=int, default=10, metavar='N',
                     help='number of epochs to train (default: 14)')
 parser.add_argument('--seed', type=int, default=1, metavar='S',
@@ -33,85 +52,326 @@ parser.add_argument('--save-image', action='store_false', default=True,
                     help='save autoencoder images')
 parser.add_argument('--no-tqdm', action='store_true', default=False,
                     help='use tqdm')
+parser.add_argument('--telemetry-interval', type=float, default=0.5, metavar='S',
+                    help='seconds between progress and metrics updates (default: 0.5)')
+parser.add_argument('--metrics-jsonl', default=None, metavar='PATH',
+                    help='append step metrics to this JSON lines file')
+parser.add_argument('--metrics-prom', default=None, metavar='PATH',
+                    help='keep the latest step metrics in this prometheus textfile')
+parser.add_argument('--no-fuse', action='store_true', default=False,
+                    help='evaluate without folding batchnorm into convolutions')
+parser.add_argument('--workers', type=int, default=0, metavar='N',
+                    help='threads training the models of one batch (default: sequential)')
+parser.add_argument('--tuned', default=None, metavar='PATH',
+                    help='use the dataloader, batch size and thread settings '
+                         'tuning.py saved for this host')
+parser.add_argument('--binarize', default=None, choices=['static', 'dynamic'],
+                    help='train on bit-packed binarized mnist, redrawn every epoch if dynamic')
+parser.add_argument('--ring', type=int, default=0, metavar='SLOTS',
+                    help='workers fill a shared memory ring of SLOTS batches (default: off)')
+parser.add_argument('--profile', type=int, default=0, metavar='N',
+                    help='profile every layer for N training steps, cut short at the end of '
+                         'the epoch (default: off)')
+parser.add_argument('--profile-start', type=int, default=10, metavar='N',
+                    help='training steps to skip before profiling (default: 10)')
+parser.add_argument('--profile-trace', default='trace.json',
+                    help='where to write the chrome trace of the profiled steps')
+parser.add_argument('--background', action='store_true', default=False,
+                    help='test and traverse a snapshot of every epoch in another process, '
+                         'with its own --workers pool, while training continues; '
+                         'training waits while the previous snapshot is still being copied')
+parser.add_argument('--store', default=None, metavar='DIR',
+                    help='reuse and record finished epochs in this experiment store')
+parser.add_argument('--store-max-age', type=float, default=None, metavar='DAYS',
+                    help='evict store entries unused for this long')
+parser.add_argument('--store-max-size', type=float, default=None, metavar='MB',
+                    help='evict least recently used store entries beyond this size')
 args = parser.parse_args()
 
 use_cuda = torch.cuda.is_available()
 device = torch.device("cuda" if use_cuda else "cpu")
 torch.manual_seed(args.seed)
 random.seed(args.seed)
+configure(console=not args.no_tqdm, interval=args.telemetry_interval,
+          jsonl=args.metrics_jsonl, prometheus=args.metrics_prom)
+tuned = [load_settings(args.tuned, f'train_{loss}_{model}')
+         for loss in args.loss for model in args.model]
+tuned = [t for t in tuned if t is not None]
+if tuned:
+    # one dataloader feeds every run, so the batch has to suit all of them
+    args.batch_size = min(t['batch_size'] for t in tuned)
+    set_threads(tuned[0])
 
-folder = f'images/{args.loss}_{args.model}'
-if not os.path.exists(folder):
-    os.makedirs(folder)
-
-
-def run_one_epoch(model, dataloader, name, epoch, optimiser=None):
-    'train if optimiser is present; save 64 images; print loss'
-    if optimiser is not None:
-        model.train()
-    else:
-        model.eval()
-    device = next(model.parameters()).device
-
-    with torch.set_grad_enabled(optimiser is not None):
-        total_loss = 0
-        progress = enumerate(dataloader)
-        if not args.no_tqdm:
-            progress = tqdm(progress, total=len(dataloader))
-        for i, (data, labels) in progress:
-            data, labels = data.to(device), labels.to(device)
-            output, loss = model.run_one_batch(data, optimiser=optimiser, labels=labels)
-            total_loss += loss
-            if not args.no_tqdm:
-                progress.set_description(f"{name} loss: {total_loss/(i+1):.4f}")
-            if i == 0 and args.save_image and optimiser is None:
-                data = data[:64, ].cpu().view(64, 1, 28, 28)
-                output = output[:64, ].cpu().view(64, 1, 28, 28)
+
+class Run:
+
+    def __init__(self, model, loss):
+        'one registry model fed by the shared dataloader, with its own optimisers'
+        self.name = f'{loss}_{model}'
+        self.config = {'model': model, 'loss': loss, 'samples': args.samples}
+        self.metrics = {}
+        self.folder = f'images/{self.name}'
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        if loss == 'hash':
+            self.config['bits'] = args.bits
+        if loss == 'nested':
+            self.config['prefixes'] = args.prefixes
+        self.model = build(model, loss, args.bits, args.samples, args.prefixes).to(device)
+        # keyword arguments of model.run_one_batch, a discriminator's included
+        self.optimisers = optimisers(self.model)
+        self.traverse = args.traverse and hasattr(self.model, 'traverse')
+
+
+def run_one_batch(model, data, labels, optimisers):
+    'grad mode is thread local, so set it here for the thread pool'
+    with torch.set_grad_enabled(bool(optimisers)):
+        output, loss = model.run_one_batch(data, labels=labels, **optimisers)
+    return output, loss.detach()
+
+
+def run_one_epoch(runs, dataloader, name, epoch, train=False, pool=None, profiler=None,
+                  quiet=False, stop=None):
+    '''
+    feed every batch to every run; train if train is set; save 64 images; print loss;
+    with stop, end early once stop.update() is satisfied with the batch losses
+    '''
+    modules = [run.model if train or args.no_fuse else fuse(run.model) for run in runs]
+    optimisers = [run.optimisers if train else {} for run in runs]
+    for model in modules:
+        model.train(train)
+
+    total_loss = [0] * len(runs)
+    images = 0
+    telemetry = Telemetry(name, len(dataloader), epoch)
+    for i, (data, labels) in enumerate(telemetry.wrap(dataloader)):
+        if profiler is not None:
+            profiler.step()
+        data, labels = telemetry.to(device, data, labels)
+        batch = [(m, data, labels, o) for m, o in zip(modules, optimisers)]
+        if pool is None:
+            results = [run_one_batch(*b) for b in batch]
+        else:
+            results = list(pool.map(lambda b: run_one_batch(*b), batch))
+        # weighted by batch size, so a short last batch counts for what it holds
+        for j, (output, loss) in enumerate(results):
+            total_loss[j] += loss * data.size(0)
+        images += data.size(0)
+        if len(runs) == 1:
+            telemetry.update(data.size(0), loss=total_loss[0]/images)
+        else:
+            telemetry.update(data.size(0), **{run.name: t/images
+                                              for run, t in zip(runs, total_loss)})
+        if i == 0 and args.save_image and not train:
+            for run, (output, _) in zip(runs, results):
+                baseline = data[:64, ].cpu()
+                output = torch.sigmoid(output[:64, ]).cpu().view(baseline.shape)
                 save = {'nrow': 8, 'pad_value': 64}
-                save_image(data, f'{folder}/{epoch}baseline.png', **save)
-                save_image(output, f'{folder}/{epoch}.png', **save)
+                save_image(baseline, f'{run.folder}/{epoch}baseline.png', **save)
+                save_image(output, f'{run.folder}/{epoch}.png', **save)
+        if stop is not None and stop.update([loss for _, loss in results]):
+            break
 
-    if args.no_tqdm:
-        print(f'{name}: Average loss: {total_loss/(i+1) :.4f}')
+    for run, total in zip(runs, total_loss):
+        run.metrics.setdefault(epoch, {})[name] = float(total / images)
+        if args.no_tqdm and not quiet:
+            print(f'{run.name} {name}: Average loss: {total/images :.4f}')
+    if stop is not None and args.no_tqdm and not quiet:
+        print(f'{name}: {images} of {len(dataloader.dataset)} images')
+    return modules
 
 
-def get_data():
+def get_data(ring=0):
     path = '../../data'
-    t = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize((0.1307,), (0.3081,))
-    ])
-    kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    loader = load_settings(args.tuned, 'loader_mnist')
+    if ring:
+        loader = {'num_workers': 2, **(loader or {}), 'ring': ring}
+    return get_mnist(path, use_cuda, args.batch_size, args.test_batch_size, loader,
+                     args.binarize)
 
-    train_loader = torch.utils.data.DataLoader(
-        datasets.MNIST(path, train=True, download=True, transform=t),
-        batch_size=args.batch_size, shuffle=True, **kwargs)
-    test_loader = torch.utils.data.DataLoader(
-        datasets.MNIST(path, train=False, download=True, transform=t),
-        batch_size=args.test_batch_size, shuffle=True, **kwargs)
-    return train_loader, test_loader
 
+def get_test(test_loader, runs):
+    'the test set decoded once into tensors, served in one fixed order at a fixed batch'
+    images, labels = materialise(test_loader.dataset, '../../data/cache')
+    batch_size = args.eval_batch or args.test_batch_size
+    if args.eval_batch == 0 and args.eval_tolerance == 0:
+        # early stopping wants many small batches; a full pass wants few large ones
+        modules = [copy.deepcopy(r.model).eval() if args.no_fuse else fuse(r.model)
+                   for r in runs]
+        batch_size = largest_batch(modules, images.to(device), args.test_batch_size)
+    return TensorLoader(test_loader.dataset, images, labels, batch_size, device)
 
-def main():
-    train_loader, test_loader = get_data()
-    encoder = models[args.model][0]()
-    decoder = models[args.model][1]()
-    model = losses[args.loss](encoder, decoder).to(device)
 
-    args.traverse = args.traverse and (args.loss != 'ae')
+def open_store(runs, train_loader, test_loader):
+    'describe every run completely enough that equal descriptions train alike'
+    size = None if args.store_max_size is None else args.store_max_size * 2**20
+    store = Store(args.store, args.store_max_age, size)
+    dataset = [fingerprint(train_loader.dataset), fingerprint(test_loader.dataset)]
+    # runs share the random state in this order, so what a run draws depends on
+    # the others and on where it sits among them
+    group = [run.name for run in runs]
+    for run in runs:
+        run.config.update({
+            'group': group,
+            'architecture': str(run.model),
+            'seed': args.seed,
+            'batch_size': args.batch_size,
+            'test_batch_size': args.test_batch_size,
+            # an early stopped test loss is an estimate, not to be served as exact
+            'eval_tolerance': args.eval_tolerance,
+            'binarize': args.binarize,
+            'dataset': dataset,
+            'code': code_version(),
+        })
+    return store
 
-    optimiser = optim.Adam(model.parameters())
-    for epoch in range(1, args.epochs + 1):
-        print(f'\n{epoch}')
-        run_one_epoch(model, train_loader, 'train', epoch, optimiser=optimiser)
-        run_one_epoch(model, test_loader, 'test', epoch)
-        if args.traverse:
+
+def resume(runs, store, train_loader):
+    'load the latest epoch every run of the group has stored; return it'
+    start = min(store.latest(run.config, args.epochs) for run in runs)
+    if start == 0:
+        return 0
+    for run in runs:
+        checkpoint, run.metrics = store.load(run.config, start)
+        run.model.load_state_dict(checkpoint['model'])
+        for name, optimiser in run.optimisers.items():
+            optimiser.load_state_dict(checkpoint[name])
+        for epoch in range(1, start + 1):
+            store.restore_images(run.config, epoch, run.folder)
+    # every run of the group stored the same random state with this epoch
+    torch.set_rng_state(checkpoint['rng'])
+    if 'binarize' in checkpoint:
+        train_loader.restore(checkpoint['binarize'])
+    for epoch in range(1, start + 1):
+        print(f'\n{epoch} (stored)')
+        for run in runs:
+            for name, loss in run.metrics[epoch].items():
+                print(f'{run.name} {name}: Average loss: {loss:.4f}')
+    return start
+
+
+def checkpoint(run, train_loader):
+    'a copy of everything resuming run needs, unaffected by further training'
+    checkpoint = {
+        'model': run.model.state_dict(),
+        'rng': torch.get_rng_state(),
+        **{name: optimiser.state_dict() for name, optimiser in run.optimisers.items()},
+    }
+    if getattr(train_loader, 'rebinarize', False):
+        # dynamic binarization draws from a generator of its own
+        checkpoint['binarize'] = train_loader.state()
+    return copy.deepcopy(checkpoint)
+
+
+def record(runs, store, epoch, checkpoints):
+    for run, stored in zip(runs, checkpoints):
+        images = [f'{run.folder}/{epoch}{n}.png' for n in ['', 'baseline', 'traverse']]
+        store.save(run.config, epoch, stored, run.metrics[epoch], images)
+
+
+def get_pool():
+    'threads for --workers, or None to run the models one after the other'
+    if args.workers == 0:
+        return None
+    # the intra-op pool is shared by every thread: split it between them
+    torch.set_num_threads(max(1, torch.get_num_threads() // args.workers))
+    return ThreadPoolExecutor(args.workers)
+
+
+@torch.inference_mode()
+def evaluate(runs, test_loader, epoch, pool=None, quiet=False):
+    'test loss, reconstructions and traversals of every run'
+    stop = ConfidenceStop(args.eval_tolerance) if args.eval_tolerance > 0 else None
+    inference = run_one_epoch(runs, test_loader, 'test', epoch, pool=pool, quiet=quiet,
+                              stop=stop)
+    for run, model in zip(runs, inference):
+        if run.traverse:
             output, width = model.traverse(test_loader)
-            save_image(output.cpu(), f'{folder}/{epoch}traverse.png',
+            save_image(output.cpu(), f'{run.folder}/{epoch}traverse.png',
                 nrow=width, pad_value=64)
 
+
+class Evaluation:
+
+    def __init__(self, names):
+        'what the background evaluator rebuilds: (model, loss) of every run'
+        self.names = names
+
+    def build(self):
+        self.runs = [Run(model, loss) for model, loss in self.names]
+        _, test_loader = get_data()
+        self.test_loader = get_test(test_loader, self.runs)
+        self.pool = get_pool()
+        return [run.model for run in self.runs]
+
+    def __call__(self, models, epoch):
+        evaluate(self.runs, self.test_loader, epoch, pool=self.pool, quiet=True)
+        return {run.name: run.metrics[epoch]['test'] for run in self.runs}
+
+
+def evaluated(runs, store, pending, epoch, losses):
+    'fold the results of a background evaluation back into the runs'
+    for run in runs:
+        run.metrics.setdefault(epoch, {})['test'] = losses[run.name]
+        if args.no_tqdm:
+            print(f'{run.name} test (epoch {epoch}): Average loss: {losses[run.name]:.4f}')
+    if store is not None:
+        record(runs, store, epoch, pending.pop(epoch))
+
+
+def main():
+    train_loader, test_loader = get_data(args.ring)
+    runs = [Run(model, loss) for loss in args.loss for model in args.model]
+    test_loader = get_test(test_loader, runs)
+
+    pool = get_pool()
+
+    start, store = 0, None
+    if args.store is not None:
+        store = open_store(runs, train_loader, test_loader)
+        start = resume(runs, store, train_loader)
+
+    profiler = None
+    if args.profile > 0:
+        modules = {f'{run.name}.{name}': layer
+                   for run in runs for name, layer in layers(run.model).items()}
+        profiler = LayerProfiler(modules, args.profile, args.profile_start,
+                                 args.profile_trace)
+
+    evaluator, pending = None, {}
+    if args.background:
+        names = [(model, loss) for loss in args.loss for model in args.model]
+        evaluator = BackgroundEvaluator(Evaluation(names), [run.model for run in runs])
+
+    for epoch in range(start + 1, args.epochs + 1):
+        print(f'\n{epoch}')
+        run_one_epoch(runs, train_loader, 'train', epoch, train=True, pool=pool,
+                      profiler=profiler)
+        if profiler is not None:
+            profiler.close()
+        if evaluator is None:
+            evaluate(runs, test_loader, epoch, pool=pool)
+            if store is not None:
+                record(runs, store, epoch, [checkpoint(run, train_loader) for run in runs])
+        else:
+            if store is not None:
+                pending[epoch] = [checkpoint(run, train_loader) for run in runs]
+            evaluator.submit(epoch, [run.model for run in runs])
+            for finished in evaluator.poll():
+                evaluated(runs, store, pending, *finished)
+
+    if evaluator is not None:
+        for finished in evaluator.close():
+            evaluated(runs, store, pending, *finished)
+
+    if store is not None:
+        store.evict()
+
     if args.save_model:
-        torch.save(model.state_dict(), f"{folder}/{epoch}.pt")
+        for run in runs:
+            torch.save(run.model.state_dict(), f"{run.folder}/{args.epochs}.pt")
+            if not args.no_fuse:
+                torch.save(fuse(run.model), f"{run.folder}/{args.epochs}fused.pt")
 
 
 if __name__ == '__main__':
@@ -5,6 +5,9 @@ from residual import Res_Encoder, Res_Decoder
 from autoencoder import Autoencoder
 from variational import VAE
 from factor import Factor_VAE
+from quantised import VQ_VAE
+from hashing import Hashing_AE
+from nested import Nested_AE
 
 models = {
     'fnn': [FNN_Encoder, FNN_Decoder],
@@ -15,5 +18,24 @@ models = {
 losses = {
     'ae': Autoencoder,
     'vae': VAE,
-    'factor': Factor_VAE
+    'factor': Factor_VAE,
+    'vq': VQ_VAE,
+    'hash': Hashing_AE,
+    'nested': Nested_AE
 }
+
+
+def build(model, loss, bits=64, samples=1, prefixes=None):
+    '''
+    the loss model on the model architecture, built as main.py builds its runs:
+    bits is the hash code width, samples feeds vae and factor, prefixes nested
+    '''
+    architecture = {'bottleneck': bits} if loss == 'hash' else {}
+    kwargs = {}
+    if loss in ['vae', 'factor']:
+        kwargs = {'samples': samples}
+    elif loss == 'nested':
+        kwargs = {'prefixes': prefixes}
+    encoder = models[model][0](**architecture)
+    decoder = models[model][1](**architecture)
+    return losses[loss](encoder, decoder, **kwargs)
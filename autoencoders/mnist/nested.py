@@ -0,0 +1,96 @@
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from autoencoder import Autoencoder
+
+
+def truncate(z, k):
+    'keep the first k latent channels, zero the rest'
+    mask = torch.arange(z.size(1), device=z.device) < k
+    return z * mask.view(1, -1, *[1] * (z.dim() - 2))
+
+
+class Nested_AE(Autoencoder):
+
+    def __init__(self, encoder, decoder, prefixes=None):
+        'every prefix length of the latent is trained to reconstruct on its own'
+        super().__init__(encoder, decoder)
+        mean = encoder.mean
+        width = mean.out_features if isinstance(mean, nn.Linear) else mean.out_channels
+        if prefixes is None:
+            prefixes = [2 ** i for i in range(width.bit_length()) if 2 ** i < width]
+        self.prefixes = sorted({k for k in prefixes if 0 < k < width} | {width})
+
+    def nest(self, z):
+        'a copy of z per prefix, stacked along the batch'
+        k = torch.tensor(self.prefixes, device=z.device).view(-1, 1)
+        mask = (torch.arange(z.size(1), device=z.device) < k).to(z.dtype)
+        mask = mask.view(len(self.prefixes), 1, z.size(1), *[1] * (z.dim() - 2))
+        return (z.unsqueeze(0) * mask).flatten(0, 1)
+
+    def forward(self, x, logits=False, k=None):
+        'pass the first k latent channels, all of them by default, through the decoder'
+        x = self.encoder(x)
+        if k is not None:
+            x = truncate(x, k)
+        x = self.decoder(x, logits)
+        return x
+
+    def encode(self, x, k=None):
+        'only the first k latent channels, to store or index'
+        return self.encoder(x)[:, :k]
+
+    def decode(self, z, logits=False):
+        'zero pad stored prefixes back to the full latent before decoding'
+        width = self.prefixes[-1]
+        padding = z.new_zeros(z.size(0), width - z.size(1), *z.shape[2:])
+        return self.decoder(torch.cat([z, padding], 1), logits)
+
+    def prefix_losses(self, data):
+        'reconstruction loss of every prefix length, and the full width output'
+        output = self.decoder(self.nest(self.encoder(data)), logits=True)
+        output = output.view(len(self.prefixes), data.size(0), -1)
+        target = data.reshape(1, data.size(0), -1).expand_as(output)
+        losses = F.binary_cross_entropy_with_logits(output, target, reduction='none')
+        return losses.sum(2).mean(1), output[-1]
+
+    def run_one_batch(self, data, optimiser=None, labels=None):
+        'returns logits of the full latent: apply a sigmoid to see images'
+        losses, output = self.prefix_losses(data)
+        loss = losses.sum()
+        if optimiser is not None:
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
+        return output, loss
+
+
+def separate_passes(model, data):
+    'the same losses, one decoder pass per prefix length'
+    z = model.encoder(data)
+    losses = []
+    for k in model.prefixes:
+        output = model.decoder(truncate(z, k), logits=True)
+        losses.append(F.binary_cross_entropy_with_logits(
+            output, data.reshape(output.shape), reduction='sum') / data.size(0))
+    return torch.stack(losses)
+
+
+if __name__ == '__main__':
+    from models import models
+    data = torch.rand(64, 1, 28, 28).bernoulli()
+    for name in ['fnn', 'cnn']:
+        model = Nested_AE(models[name][0](), models[name][1]()).eval()
+        times, losses = {}, {}
+        with torch.no_grad():
+            for passes, step in [('batched', lambda: model.prefix_losses(data)[0]),
+                                 ('separate', lambda: separate_passes(model, data))]:
+                losses[passes] = step()
+                start = time.perf_counter()
+                for _ in range(10):
+                    step()
+                times[passes] = 100 * (time.perf_counter() - start)
+        agree = torch.allclose(losses['batched'], losses['separate'], rtol=1e-4)
+        print(f"{name} prefixes {model.prefixes}: batched {times['batched']:6.2f} ms"
+              f"  separate {times['separate']:6.2f} ms  agree: {agree}")
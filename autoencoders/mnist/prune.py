@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+physically remove the decoder channels with the smallest batchnorm scales, then fine tune
+"""
+import argparse
+import itertools
+import math
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from models import models, losses
+from dataloaders import get_mnist
+from residual import BasicBlock, ELU_BatchNorm2d
+from fuse import fuse
+
+
+parser = argparse.ArgumentParser(description='structured channel pruning of a decoder')
+parser.add_argument('--model', default='cnn',
+                    help='registry architecture: cnn or res')
+parser.add_argument('--loss', default='ae',
+                    help='what loss the model was trained with')
+parser.add_argument('--weights', default=None,
+                    help='its state_dict, as main.py --save-model writes it')
+parser.add_argument('--fraction', type=float, default=0.5,
+                    help='fraction of the channels of every group to remove')
+parser.add_argument('--finetune-batches', type=int, default=200)
+parser.add_argument('--batch-size', type=int, default=64, metavar='N',
+                    help='input batch size for fine tuning (default: 64)')
+parser.add_argument('--test-batch-size', type=int, default=1000, metavar='N',
+                    help='input batch size for testing (default: 1000)')
+parser.add_argument('--output', default='pruned.pt',
+                    help='where to save the decoder filters and the state_dict')
+
+
+def _select(module, role, index):
+    'keep only the channels in index: outputs, inputs or batchnorm features'
+    if role == 'bn':
+        module.weight = nn.Parameter(module.weight[index])
+        module.bias = nn.Parameter(module.bias[index])
+        module.running_mean = module.running_mean[index]
+        module.running_var = module.running_var[index]
+        module.num_features = len(index)
+        return
+    # conv weights are (out, in, ...), transposed conv weights (in, out, ...)
+    transposed = isinstance(module, nn.ConvTranspose2d)
+    dim = int(transposed) if role == 'out' else int(not transposed)
+    module.weight = nn.Parameter(module.weight.index_select(dim, index))
+    if role == 'out':
+        module.out_channels = len(index)
+        if module.bias is not None:
+            module.bias = nn.Parameter(module.bias[index])
+    else:
+        module.in_channels = len(index)
+
+
+def groups(sequential):
+    '''
+    channel groups that must shrink together, each ranked by one batchnorm or,
+    without one, by the convolution producing them:
+    (ranking, [(module, role)], [(ranking, members) that keep as many channels])
+    '''
+    found, members, tied, gate = [], [], [], None
+    for module in sequential:
+        if isinstance(module, (nn.Conv2d, nn.ConvTranspose2d)):
+            if gate is not None:
+                found.append((gate, members + [(module, 'in')], tied))
+            elif found and members[0][0].out_channels == len(_scores(found[-1][0])):
+                # an ungated convolution as wide as the last group shrinks with it
+                found[-1][2].append((members[0][0], members + [(module, 'in')]))
+            elif members:
+                found.append((members[0][0], members + [(module, 'in')], tied))
+            members, tied, gate = [(module, 'out')], [], None
+        elif isinstance(module, BasicBlock):
+            # the skip connection carries the outer channels through the block
+            r = module.residual
+            members += [(r[0], 'in'), (r[3], 'out'), (r[4], 'bn')]
+            tied.append((r[1], [(r[0], 'out'), (r[1], 'bn'), (r[3], 'in')]))
+        elif isinstance(module, (nn.BatchNorm2d, ELU_BatchNorm2d)):
+            gate = module if isinstance(module, nn.BatchNorm2d) else module.actnorm[1]
+            members.append((gate, 'bn'))
+    return found
+
+
+def _scores(ranking):
+    'batchnorm scales, or the l1 norms of the output filters of a convolution'
+    if isinstance(ranking, nn.BatchNorm2d):
+        return ranking.weight.abs()
+    dim = int(isinstance(ranking, nn.ConvTranspose2d))
+    return ranking.weight.abs().transpose(0, dim).flatten(1).sum(1)
+
+
+def _strongest(ranking, keep):
+    'indices of the keep highest scoring channels, in their original order'
+    return _scores(ranking).topk(keep).indices.sort().values
+
+
+@torch.no_grad()
+def prune(decoder, fraction):
+    'shrink every channel group of the decoder in place; returns the decoder'
+    for ranking, members, tied in groups(decoder.main):
+        keep = max(1, math.ceil((1 - fraction) * len(_scores(ranking))))
+        for inner, inner_members in tied:
+            index = _strongest(inner, keep)
+            for module, role in inner_members:
+                _select(module, role, index)
+        index = _strongest(ranking, keep)
+        for module, role in members:
+            _select(module, role, index)
+    return decoder
+
+
+def widths(decoder):
+    'the filters argument a registry decoder needs to take these weights'
+    convs = [decoder.main[0]] + [m for m in decoder.main if isinstance(m, nn.ConvTranspose2d)]
+    return [c.out_channels for c in reversed(convs)]
+
+
+@torch.no_grad()
+def evaluate(model, test_loader, device):
+    model.eval()
+    total = sum(model.run_one_batch(data.to(device))[1].item() for data, _ in test_loader)
+    return total / len(test_loader)
+
+
+@torch.inference_mode()
+def latencies(decoders, z, warmup=10, repeats=200):
+    '''
+    median milliseconds of one fused cpu pass of every decoder, taken in turn
+    so that drift in the machine's speed hits them all alike
+    '''
+    decoders = [fuse(decoder).cpu() for decoder in decoders]
+    for _ in range(warmup):
+        for decoder in decoders:
+            decoder(z)
+    times = [[] for _ in decoders]
+    for _ in range(repeats):
+        for decoder, measured in zip(decoders, times):
+            start = time.perf_counter()
+            decoder(z)
+            measured.append(1000 * (time.perf_counter() - start))
+    return [sorted(measured)[len(measured) // 2] for measured in times]
+
+
+def finetune(model, train_loader, batches, device):
+    model.train()
+    optimiser = optim.Adam(model.parameters())
+    for data, _ in itertools.islice(train_loader, batches):
+        model.run_one_batch(data.to(device), optimiser=optimiser)
+
+
+def main():
+    args = parser.parse_args()
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    path = '../../data'
+    train_loader, test_loader = get_mnist(
+        path, use_cuda, args.batch_size, args.test_batch_size)
+
+    encoder, decoder = models[args.model][0](), models[args.model][1]()
+    model = losses[args.loss](encoder, decoder).to(device)
+    if args.weights is not None:
+        model.load_state_dict(torch.load(args.weights, map_location=device))
+    probe = next(iter(test_loader))[0][:64]
+    z = model.encoder.cpu()(probe).detach()
+    model.to(device)
+    dense = fuse(model.decoder)
+    before = {'loss': evaluate(model, test_loader, device),
+              'params': sum(p.numel() for p in model.decoder.parameters())}
+
+    original = widths(model.decoder)
+    prune(model.decoder, args.fraction)
+    filters = widths(model.decoder)
+    # the pruned weights load into a registry decoder built with these filters
+    slim = losses[args.loss](encoder, models[args.model][1](filters=filters))
+    slim.load_state_dict(model.state_dict())
+    slim.to(device)
+    pruned = evaluate(slim, test_loader, device)
+    finetune(slim, train_loader, args.finetune_batches, device)
+    after = {'loss': evaluate(slim, test_loader, device),
+             'params': sum(p.numel() for p in slim.decoder.parameters())}
+    before['latency'], after['latency'] = latencies([dense, slim.decoder], z)
+
+    print(f'decoder filters {original} -> {filters}')
+    print(f"loss {before['loss']:.2f} -> {pruned:.2f} pruned -> "
+          f"{after['loss']:.2f} after {args.finetune_batches} fine tuning batches")
+    print(f"decoder parameters {before['params']} -> {after['params']}, "
+          f"latency {before['latency']:.3f} -> {after['latency']:.3f} ms "
+          f"({before['latency'] / after['latency']:.2f}x)")
+    torch.save({'decoder_filters': filters, 'model': slim.state_dict()}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from autoencoder import Autoencoder
+
+
+def nearest(rows, codebook, chunk=8192):
+    'index of the closest code to every row, one matrix multiply per chunk of rows'
+    # |row - code|^2 without |row|^2, which is the same for every code
+    norms = codebook.pow(2).sum(1)
+    return torch.cat([torch.addmm(norms, part, codebook.t(), alpha=-2).argmin(1)
+                      for part in rows.split(chunk)])
+
+
+class VQ_VAE(Autoencoder):
+
+    def __init__(self, encoder, decoder, codes=512, commitment=0.25, decay=0.99,
+                 dead=1e-2, epsilon=1e-5):
+        'the encoder mean is snapped to the closest of codes learned vectors'
+        super().__init__(encoder, decoder)
+        mean = encoder.mean
+        width = mean.out_features if isinstance(mean, nn.Linear) else mean.out_channels
+        self.commitment = commitment
+        self.decay = decay
+        self.dead = dead
+        self.epsilon = epsilon
+        self.register_buffer('codebook', torch.randn(codes, width))
+        self.register_buffer('cluster_size', torch.ones(codes))
+        self.register_buffer('code_sum', self.codebook.clone())
+
+    def _rows(self, z):
+        'one row per latent vector: channels last, everything else flattened'
+        return z.movedim(1, -1).reshape(-1, z.size(1))
+
+    def _unrows(self, rows, z):
+        return rows.view(*z.movedim(1, -1).shape).movedim(-1, 1)
+
+    def quantise(self, z):
+        'closest codes and their indices, shaped like z without channels'
+        indices = nearest(self._rows(z).detach(), self.codebook)
+        shape = z.movedim(1, -1).shape[:-1]
+        return self._unrows(self.codebook[indices], z), indices.view(shape)
+
+    @torch.no_grad()
+    def _update(self, rows, indices):
+        'exponential moving averages of code usage and of the vectors assigned'
+        counts = torch.bincount(indices, minlength=len(self.codebook)).float()
+        sums = torch.zeros_like(self.code_sum).index_add_(0, indices, rows)
+        self.cluster_size.mul_(self.decay).add_(counts, alpha=1 - self.decay)
+        self.code_sum.mul_(self.decay).add_(sums, alpha=1 - self.decay)
+        total = self.cluster_size.sum()
+        smoothed = self.cluster_size + self.epsilon
+        smoothed = smoothed / (total + len(self.codebook) * self.epsilon) * total
+        self.codebook.copy_(self.code_sum / smoothed.unsqueeze(1))
+
+        # codes nobody has picked lately restart on vectors from this batch
+        dead = (self.cluster_size < self.dead).nonzero().squeeze(1)
+        if len(dead) > 0:
+            chosen = rows[torch.randint(len(rows), (len(dead),), device=rows.device)]
+            self.codebook[dead] = chosen
+            self.code_sum[dead] = chosen
+            self.cluster_size[dead] = 1
+
+    def forward(self, x, logits=False):
+        'pass the quantised encoding through the decoder'
+        z = self.encoder(x)
+        quantised, _ = self.quantise(z)
+        return self.decoder(quantised, logits)
+
+    def run_one_batch(self, data, optimiser=None, labels=None):
+        'returns logits: apply a sigmoid to see images'
+        z = self.encoder(data)
+        quantised, indices = self.quantise(z)
+        if self.training:
+            self._update(self._rows(z.detach()), indices.flatten())
+        # straight through: the decoder sees the codes, the encoder gets their gradient
+        output = self.decoder(z + (quantised - z).detach(), logits=True)
+        datasize = data.size(0)
+        data = data.reshape(output.shape)
+        loss = F.binary_cross_entropy_with_logits(output, data, reduction='sum')
+        loss = loss + self.commitment * F.mse_loss(z, quantised.detach(), reduction='sum')
+        loss = loss / datasize
+        if optimiser is not None:
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
+        return output, loss
+
+    def export(self, x):
+        'code indices of x as uint8, or uint16 for codebooks over 256 codes'
+        _, indices = self.quantise(self.encoder(x))
+        dtype = np.uint8 if len(self.codebook) <= 256 else np.uint16
+        return indices.cpu().numpy().astype(dtype)
+
+    def decode(self, indices, logits=False):
+        'images from exported code indices'
+        indices = torch.as_tensor(indices.astype(np.int64), device=self.codebook.device)
+        quantised = self.codebook[indices].movedim(-1, 1)
+        return self.decoder(quantised, logits)
+
+
+if __name__ == '__main__':
+    rows = torch.randn(16384, 10)
+    for codes in [512, 4096, 16384]:
+        codebook = torch.randn(codes, 10)
+        start = time.perf_counter()
+        vectorised = nearest(rows, codebook)
+        middle = time.perf_counter()
+        pairwise = torch.cdist(rows, codebook).argmin(1)
+        end = time.perf_counter()
+        print(f'{codes:6d} codes: nearest {1000 * (middle - start):8.1f} ms, '
+              f'cdist {1000 * (end - middle):8.1f} ms for {len(rows)} vectors, '
+              f'agree: {bool((pairwise == vectorised).all())}')
@@ -68,6 +68,7 @@ class Res_Decoder(Decoder):
     def __init__(self, filters=[4, 8, 16, 32], bottleneck=10):
         super().__init__()
         self.activate = nn.ELU()
+        self.sigmoid = nn.Sigmoid()
         self.main = nn.Sequential(
             nn.Conv2d(bottleneck, filters[-1], 1, 1, bias=False),
             self.activate,
@@ -89,6 +90,5 @@ class Res_Decoder(Decoder):
 
             BasicBlock(filters[-4]),
             ELU_BatchNorm2d(filters[-4]),
-            nn.Conv2d(filters[-4], 1, 3, 1, padding=1),
-            nn.Sigmoid()
+            nn.Conv2d(filters[-4], 1, 3, 1, padding=1)
         )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+cache finished epochs of experiments under a hash of their configuration
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import torch
+
+
+def fingerprint(dataset):
+    'hash of the images and labels a dataset serves'
+    digest = hashlib.sha1()
+    digest.update(np.asarray(dataset.data).tobytes())
+    digest.update(np.asarray(dataset.targets).tobytes())
+    return digest.hexdigest()
+
+
+def code_version(folder=None):
+    'hash of every python file in folder, by default the one holding this module'
+    if folder is None:
+        folder = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for name in sorted(glob.glob(f'{folder}/*.py')):
+        with open(name, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+class Store:
+
+    def __init__(self, root, max_age=None, max_size=None):
+        'max_age in days and max_size in bytes bound what evict() keeps'
+        self.root = root
+        self.max_age = max_age
+        self.max_size = max_size
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def key(self, config):
+        'configs never hold the number of epochs: every epoch is stored separately'
+        text = json.dumps(config, sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, config):
+        return os.path.join(self.root, self.key(config))
+
+    def latest(self, config, epochs):
+        'the closest stored epoch not after epochs, or 0 if nothing is stored'
+        path = self.path(config)
+        stored = [int(os.path.basename(f)[:-3])
+                  for f in glob.glob(f'{path}/*.pt')]
+        stored = [e for e in stored if e <= epochs]
+        if stored:
+            os.utime(path)
+        return max(stored, default=0)
+
+    def load(self, config, epoch):
+        'checkpoint dictionary and metrics of every epoch up to epoch'
+        path = self.path(config)
+        checkpoint = torch.load(f'{path}/{epoch}.pt', weights_only=False)
+        with open(f'{path}/metrics.json') as f:
+            metrics = json.load(f)
+        metrics = {int(e): m for e, m in metrics.items() if int(e) <= epoch}
+        return checkpoint, metrics
+
+    def save(self, config, epoch, checkpoint, metrics, images=()):
+        'store one finished epoch: weights, its metrics and its images'
+        path = self.path(config)
+        if not os.path.exists(path):
+            os.makedirs(path)
+            with open(f'{path}/config.json', 'w') as f:
+                json.dump(config, f, sort_keys=True, indent=2)
+        stored = {}
+        if os.path.exists(f'{path}/metrics.json'):
+            with open(f'{path}/metrics.json') as f:
+                stored = json.load(f)
+        stored[str(epoch)] = metrics
+        with open(f'{path}/metrics.json', 'w') as f:
+            json.dump(stored, f, indent=2)
+        for image in images:
+            if os.path.exists(image):
+                shutil.copy(image, path)
+        torch.save(checkpoint, f'{path}/{epoch}.pt')
+
+    def restore_images(self, config, epoch, folder):
+        'copy the stored images of one epoch into folder'
+        path = self.path(config)
+        for name in ['', 'baseline', 'traverse']:
+            image = f'{path}/{epoch}{name}.png'
+            if os.path.exists(image):
+                shutil.copy(image, folder)
+
+    def evict(self):
+        'drop entries unused for max_age days, then the least recently used'
+        entries = [os.path.join(self.root, e) for e in os.listdir(self.root)]
+        entries = sorted(entries, key=os.path.getmtime)
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age * 24 * 60 * 60
+            for entry in [e for e in entries if os.path.getmtime(e) < cutoff]:
+                shutil.rmtree(entry)
+                entries.remove(entry)
+        if self.max_size is not None:
+            sizes = [_size(e) for e in entries]
+            while entries and sum(sizes) > self.max_size:
+                shutil.rmtree(entries.pop(0))
+                sizes.pop(0)
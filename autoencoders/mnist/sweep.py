@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+sample filter widths and bottlenecks, prune by pareto rank, report the front
+"""
+import argparse
+import itertools
+import json
+import random
+import time
+import torch
+import torch.optim as optim
+
+from models import models, losses
+from dataloaders import get_mnist, make_loader
+from fuse import fuse
+
+
+parser = argparse.ArgumentParser(description='latency aware architecture sweep')
+parser.add_argument('--models', default=['cnn', 'res'], nargs='+',
+                    help='registry architectures taking filters and bottleneck')
+parser.add_argument('--loss', default='ae',
+                    help='what loss function to train every candidate with')
+parser.add_argument('--candidates', type=int, default=16,
+                    help='configurations sampled')
+parser.add_argument('--widths', type=int, nargs='+', default=[2, 4, 8, 16, 32, 64],
+                    help='filter counts to choose the four stages from')
+parser.add_argument('--bottlenecks', type=int, nargs='+', default=[2, 4, 8, 10, 16, 32])
+parser.add_argument('--rungs', type=int, default=3,
+                    help='rounds of training, each followed by pruning')
+parser.add_argument('--rung-batches', type=int, default=200,
+                    help='training batches per candidate per rung')
+parser.add_argument('--keep', type=float, default=0.5,
+                    help='fraction of candidates surviving every rung')
+parser.add_argument('--latency-batch', type=int, default=64,
+                    help='batch size CPU latency is measured at')
+parser.add_argument('--batch-size', type=int, default=64, metavar='N',
+                    help='input batch size for training (default: 64)')
+parser.add_argument('--test-batch-size', type=int, default=1000, metavar='N',
+                    help='input batch size for validation and test (default: 1000)')
+parser.add_argument('--validation', type=int, default=2000, metavar='N',
+                    help='training images held out to rank candidates on (default: 2000)')
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--output', default=None,
+                    help='json file to write every candidate to')
+
+
+def sample(rng, names, widths, bottlenecks, n):
+    'n distinct (model, filters, bottleneck) configurations, widths never shrinking'
+    space = list(itertools.product(
+        names, itertools.combinations_with_replacement(sorted(widths), 4), bottlenecks))
+    return [(name, list(filters), bottleneck)
+            for name, filters, bottleneck in rng.sample(space, min(n, len(space)))]
+
+
+def dominates(a, b):
+    return all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+
+def pareto(points):
+    'indices of the points no other point dominates'
+    return [i for i, p in enumerate(points)
+            if not any(dominates(q, p) for q in points)]
+
+
+def ranks(points):
+    'non dominated sorting: 0 for the front, 1 for the front without it, ...'
+    remaining = list(range(len(points)))
+    rank = [0] * len(points)
+    level = 0
+    while remaining:
+        front = [remaining[i] for i in pareto([points[i] for i in remaining])]
+        for i in front:
+            rank[i] = level
+        remaining = [i for i in remaining if i not in front]
+        level += 1
+    return rank
+
+
+def _leaves(model):
+    return [m for m in model.modules() if len(list(m.children())) == 0]
+
+
+@torch.inference_mode()
+def memory(model, data):
+    'bytes of weights plus the largest input and output any one layer holds'
+    weights = sum(t.numel() * t.element_size()
+                  for t in itertools.chain(model.parameters(), model.buffers()))
+    peak = [0]
+
+    def hook(module, inputs, output):
+        held = sum(t.numel() * t.element_size() for t in inputs + (output,))
+        peak[0] = max(peak[0], held)
+
+    handles = [m.register_forward_hook(hook) for m in _leaves(model)]
+    model(data)
+    for handle in handles:
+        handle.remove()
+    return weights + peak[0]
+
+
+@torch.inference_mode()
+def latency(model, data, repeats=20):
+    'median milliseconds of one fused forward pass on the cpu'
+    model = fuse(model.cpu())
+    model(data)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model(data)
+        times.append(1000 * (time.perf_counter() - start))
+    return sorted(times)[len(times) // 2]
+
+
+class Candidate:
+
+    def __init__(self, name, filters, bottleneck, loss, device):
+        self.name = name
+        self.filters = filters
+        self.bottleneck = bottleneck
+        encoder = models[name][0](filters=filters, bottleneck=bottleneck)
+        decoder = models[name][1](filters=filters, bottleneck=bottleneck)
+        self.model = losses[loss](encoder, decoder).to(device)
+        self.optimiser = optim.Adam(self.model.parameters())
+        self.loss = float('inf')
+        self.test = None
+        self.rungs = 0
+
+    def describe(self):
+        return {'model': self.name, 'filters': self.filters, 'bottleneck': self.bottleneck,
+                'loss': self.loss, 'test_loss': self.test, 'latency_ms': self.latency,
+                'memory': self.memory, 'rungs': self.rungs}
+
+    def objectives(self):
+        return (self.loss, self.latency, self.memory)
+
+
+def batches(dataloader):
+    'cycle the shared dataloader forever'
+    while True:
+        for data, labels in dataloader:
+            yield data, labels
+
+
+@torch.no_grad()
+def validate(candidate, validation):
+    candidate.model.eval()
+    total = sum(candidate.model.run_one_batch(data)[1].item() for data in validation)
+    return total / len(validation)
+
+
+def main():
+    args = parser.parse_args()
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+    torch.manual_seed(args.seed)
+    rng = random.Random(args.seed)
+
+    path = '../../data'
+    train_loader, test_loader = get_mnist(
+        path, use_cuda, args.batch_size, args.test_batch_size)
+    # candidates are ranked on training images they never train on, so the
+    # test set only scores the final front
+    training = train_loader.dataset
+    split = [len(training) - args.validation, args.validation]
+    training, held_out = torch.utils.data.random_split(
+        training, split, generator=torch.Generator().manual_seed(args.seed))
+    kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
+    train_loader = make_loader(training, args.batch_size, **kwargs)
+    validation = [data.to(device) for data, _ in
+                  make_loader(held_out, args.test_batch_size, shuffle=False, **kwargs)]
+    probe = validation[0][:args.latency_batch].cpu()
+
+    configurations = sample(rng, args.models, args.widths, args.bottlenecks,
+                            args.candidates)
+    candidates = [Candidate(*c, args.loss, device) for c in configurations]
+    for c in candidates:
+        c.memory = memory(c.model.cpu().eval(), probe)
+        c.latency = latency(c.model, probe)
+        c.model.to(device)
+
+    stream = batches(train_loader)
+    alive = candidates
+    for rung in range(1, args.rungs + 1):
+        # every alive candidate trains on the same batches, read once
+        for c in alive:
+            c.model.train()
+        for data, labels in itertools.islice(stream, args.rung_batches):
+            data = data.to(device)
+            for c in alive:
+                c.model.run_one_batch(data, optimiser=c.optimiser)
+        for c in alive:
+            c.loss = validate(c, validation)
+            c.rungs = rung
+        print(f'rung {rung}: ' + '  '.join(f'{c.name}{c.filters}/{c.bottleneck} {c.loss:.1f}'
+                                            for c in alive))
+        if rung < args.rungs:
+            # prune by pareto rank, so fast but weaker candidates can survive
+            rank = ranks([c.objectives() for c in alive])
+            order = sorted(range(len(alive)), key=lambda i: (rank[i], alive[i].loss))
+            keep = max(1, round(args.keep * len(alive)))
+            alive = [alive[i] for i in order[:keep]]
+
+    front = [alive[i] for i in pareto([c.objectives() for c in alive])]
+    front.sort(key=lambda c: c.latency)
+    test = [data.to(device) for data, _ in test_loader]
+    for c in front:
+        c.test = validate(c, test)
+    print(f"\n{'model':>6} {'filters':>16} {'bottleneck':>10} {'val loss':>9} "
+          f"{'test loss':>9} {'latency ms':>10} {'memory KiB':>10}")
+    for c in front:
+        print(f'{c.name:>6} {str(c.filters):>16} {c.bottleneck:10d} {c.loss:9.2f} '
+              f'{c.test:9.2f} {c.latency:10.3f} {c.memory / 1024:10.1f}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'front': [c.describe() for c in front],
+                       'candidates': [c.describe() for c in candidates]}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+measure which dataloader, batch size and thread settings are fastest on this host
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import time
+import torch
+
+import dataloaders
+from models import build as build_model
+from factor import optimisers
+
+
+def load_settings(path, key):
+    'settings tuned on this host under key, or None'
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get(socket.gethostname(), {}).get(key)
+
+
+def save_settings(path, key, settings):
+    'remember settings for this host under key, keeping everything else'
+    tuned = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            tuned = json.load(f)
+    tuned.setdefault(socket.gethostname(), {})[key] = settings
+    with open(path, 'w') as f:
+        json.dump(tuned, f, indent=2, sort_keys=True)
+
+
+def set_threads(settings):
+    'apply tuned intra-op and inter-op thread counts before any training'
+    if settings is None:
+        return
+    if 'threads' in settings:
+        torch.set_num_threads(settings['threads'])
+    if 'interop_threads' in settings:
+        torch.set_num_interop_threads(settings['interop_threads'])
+
+
+def workload(name, device, **options):
+    '''
+    builder of model and optimisers, training step and image shape of run name;
+    options are the bits, samples and prefixes main.py builds the run with
+    '''
+    loss, model = name.split('_', 1)
+
+    def build():
+        module = build_model(model, loss, **options).to(device)
+        return module, optimisers(module)
+
+    def step(module, trainers, data, labels):
+        module.run_one_batch(data, labels=labels, **trainers)
+
+    return build, step, (1, 28, 28)
+
+
+def candidates(use_cuda, max_workers):
+    'num_workers, prefetch_factor, persistent_workers, pin_memory and rings to try'
+    workers = sorted({w for w in [0, 1, 2, 4, 8, max_workers] if w <= max_workers})
+    pinning = [False, True] if use_cuda else [False]
+    for w, pin in itertools.product(workers, pinning):
+        if w == 0:
+            yield {'num_workers': 0, 'pin_memory': pin}
+            continue
+        for prefetch, persistent in itertools.product([2, 4], [False, True]):
+            yield {'num_workers': w, 'pin_memory': pin,
+                   'prefetch_factor': prefetch, 'persistent_workers': persistent}
+        if not pin:
+            yield {'num_workers': w, 'ring': 2 * w + 2}
+
+
+def measure(dataset, batch_size, settings, device, steps=50, epochs=2):
+    'images per second over a few short epochs, copies to device included'
+    loader = dataloaders.make_loader(dataset, batch_size, **settings)
+    start = time.perf_counter()
+    images = 0
+    for _ in range(epochs):
+        for i, (data, _) in enumerate(loader):
+            data = data.to(device, non_blocking=True)
+            images += data.size(0)
+            if i + 1 == steps:
+                break
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    speed = images / (time.perf_counter() - start)
+    if hasattr(loader, 'close'):
+        loader.close()
+    return speed
+
+
+def tune_loader(dataset, batch_size, device, steps=50):
+    'try every candidate and return the fastest settings'
+    results = []
+    for settings in candidates(device.type == 'cuda', os.cpu_count() or 1):
+        speed = measure(dataset, batch_size, settings, device, steps)
+        results.append((speed, settings))
+        print(f'{speed:10.0f} images/s  {settings}')
+    return max(results, key=lambda r: r[0])[1]
+
+
+def _saved_bytes(step, *args):
+    'bytes autograd keeps for backward during one step'
+    total = [0]
+
+    def pack(tensor):
+        total[0] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        step(*args)
+    return total[0]
+
+
+def measure_training(build, step, shape, batch_size, device, steps=10, warmup=2):
+    'images per second and peak bytes of training on random batches'
+    module, optimiser = build()
+    module.train()
+    data = torch.rand(batch_size, *shape, device=device)
+    labels = torch.randint(10, (batch_size,), device=device)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    for _ in range(warmup):
+        step(module, optimiser, data, labels)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(steps):
+        step(module, optimiser, data, labels)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    speed = steps * batch_size / (time.perf_counter() - start)
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated(device)
+    else:
+        # weights, gradients and both adam moments, plus activations and input;
+        # counting the activations takes one more step, outside the timing
+        weights = sum(p.numel() * p.element_size() for p in module.parameters())
+        activations = _saved_bytes(step, module, optimiser, data, labels)
+        peak = 4 * weights + activations + data.numel() * data.element_size()
+    return speed, peak
+
+
+def _sweep(name, device, interop, threads, batch_sizes, memory, options):
+    'every thread count and batch size, inside a process with interop threads'
+    torch.set_num_interop_threads(interop)
+    device = torch.device(device)
+    build, step, shape = workload(name, device, **options)
+    results = []
+    for t in threads:
+        torch.set_num_threads(t)
+        for batch_size in sorted(batch_sizes):
+            speed, peak = measure_training(build, step, shape, batch_size, device)
+            if memory is not None and peak > memory:
+                break
+            results.append({'batch_size': batch_size, 'threads': t,
+                            'interop_threads': interop,
+                            'images_per_sec': speed, 'bytes': peak})
+    return results
+
+
+def tune_training(name, device, batch_sizes, memory=None, options=None):
+    '''
+    fastest batch size and thread counts for run name within memory bytes,
+    built with the workload options
+    '''
+    cores = os.cpu_count() or 1
+    threads = sorted({t for t in [1, 2, 4, 8, 16, cores] if t <= cores})
+    interops = sorted({t for t in [1, 2, cores] if t <= cores})
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for interop in interops:
+        # inter-op threads can only be set before any parallel work is done,
+        # so every count gets a fresh process
+        with context.Pool(1) as pool:
+            results += pool.apply(
+                _sweep, (name, str(device), interop, threads, batch_sizes, memory,
+                         options or {}))
+    for r in results:
+        print(f"{r['images_per_sec']:10.0f} images/s {r['bytes'] / 2 ** 20:8.1f} MiB"
+              f"  batch {r['batch_size']} threads {r['threads']}"
+              f" interop {r['interop_threads']}")
+    if not results:
+        raise ValueError(f'no batch size of {name} fits in {memory} bytes')
+    best = max(results, key=lambda r: r['images_per_sec'])
+    return {k: best[k] for k in ['batch_size', 'threads', 'interop_threads']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='tune dataloader or training settings')
+    parser.add_argument('--dataset', default='mnist',
+                        help='any get_<dataset> in dataloaders.py')
+    parser.add_argument('--path', default='../../data')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--steps', type=int, default=50,
+                        help='batches per measured epoch')
+    parser.add_argument('--train', default=None, metavar='NAME',
+                        help='tune batch size and threads of a run, e.g. vae_fnn')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[16, 32, 64, 128, 256, 512])
+    parser.add_argument('--memory', type=float, default=None, metavar='MB',
+                        help='largest training footprint allowed')
+    parser.add_argument('--bits', type=int, default=64, metavar='N',
+                        help='hash code width, as main.py --bits (default: 64)')
+    parser.add_argument('--samples', type=int, default=1, metavar='K',
+                        help='vae and factor samples, as main.py --samples (default: 1)')
+    parser.add_argument('--prefixes', type=int, nargs='+', default=None, metavar='K',
+                        help='nested prefix lengths, as main.py --prefixes')
+    parser.add_argument('--output', default='tuned.json',
+                        help='file the best settings are saved to, per host')
+    args = parser.parse_args()
+
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+    if args.train is not None:
+        memory = None if args.memory is None else args.memory * 2 ** 20
+        options = {'bits': args.bits, 'samples': args.samples, 'prefixes': args.prefixes}
+        best = tune_training(args.train, device, args.batch_sizes, memory, options)
+        print(f'best: {best}')
+        save_settings(args.output, f'train_{args.train}', best)
+    else:
+        get_data = getattr(dataloaders, f'get_{args.dataset}')
+        train_loader = get_data(args.path, use_cuda, args.batch_size, args.batch_size)[0]
+        best = tune_loader(train_loader.dataset, args.batch_size, device, args.steps)
+        print(f'best: {best}')
+        save_settings(args.output, f'loader_{args.dataset}', best)
@@ -1,47 +1,100 @@
+import math
+import time
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from autoencoder import Autoencoder
 
 
-def variational_loss(output, data, mean, logvar):
-    'sum reconstruction and divergence losses'
-    reconstruction = F.binary_cross_entropy(output, data, reduction='sum')
+def variational_loss(output, data, mean, logvar, beta=500, logits=False):
+    'sum reconstruction and divergence losses; output are logits if logits'
+    bce = F.binary_cross_entropy_with_logits if logits else F.binary_cross_entropy
+    reconstruction = bce(output, data, reduction='sum')
     divergence = -0.5 * torch.sum(1 + logvar - mean.pow(2) - logvar.exp())
-    return reconstruction + 500 * divergence
+    return reconstruction + beta * divergence
+
+
+def log_weights(output, data, z, mean, logvar):
+    'log p(x|z) and log p(z) - log q(z|x) of every sample; samples lead output and z'
+    samples, datasize = z.shape[:2]
+    target = data.reshape(1, datasize, -1).expand(samples, -1, -1)
+    output = output.reshape(target.shape)
+    likelihood = -F.binary_cross_entropy_with_logits(output, target, reduction='none')
+    likelihood = likelihood.sum(-1)
+    # the constants of both gaussians cancel
+    eps = (z - mean) * torch.exp(-0.5*logvar)
+    prior = -0.5 * (z.pow(2) - eps.pow(2) - logvar).flatten(2).sum(-1)
+    return likelihood, prior
+
+
+def importance_weighted_loss(output, data, z, mean, logvar, beta=1):
+    '''
+    negative k sample bound summed over the batch; a beta other than 1 weights
+    the prior term, which trains well but is no longer the bound
+    '''
+    likelihood, prior = log_weights(output, data, z, mean, logvar)
+    bound = torch.logsumexp(likelihood + beta * prior, 0) - math.log(z.size(0))
+    return -bound.sum()
 
 
 class VAE(Autoencoder):
 
-    def __init__(self, encoder, decoder):
-        'define encoder and decoder'
+    def __init__(self, encoder, decoder, samples=1, beta=500):
+        'define encoder and decoder; samples > 1 trains on the importance weighted bound'
         super().__init__(encoder, decoder)
+        self.samples = samples
+        self.beta = beta
+
+    def sample(self, mean, logvar, samples):
+        'draws from gaussian of mean and logvar, stacked in a new first dimension'
+        std = torch.exp(0.5*logvar)
+        eps = torch.randn((samples,) + std.shape, device=std.device, dtype=std.dtype)
+        return mean + eps*std
 
     def repameterise(self, mean, logvar):
         'sample encoding from gaussian of mean and logvar'
         if self.training:
-            std = torch.exp(0.5*logvar)
-            eps = torch.randn_like(std)
-            mean += eps*std
+            return self.sample(mean, logvar, 1)[0]
         return mean
 
-    def forward(self, x):
+    def forward(self, x, logits=False):
         'pass through encoder and decoder'
         mean, logvar = self.encoder(x, variational=True)
         x = self.repameterise(mean, logvar)
-        x = self.decoder(x)
+        x = self.decoder(x, logits)
         return x, mean, logvar
 
+    def bound(self, data):
+        '''
+        logits, the loss to train on and the loss to report, both summed over
+        the batch, and the latents decoded; with samples > 1 beta only weights
+        the first, the second is the importance weighted bound itself
+        '''
+        mean, logvar = self.encoder(data, variational=True)
+        if self.samples == 1:
+            z = self.repameterise(mean, logvar)
+            output = self.decoder(z, logits=True)
+            target = data.reshape(output.shape)
+            loss = variational_loss(output, target, mean, logvar, self.beta, logits=True)
+            return output, loss, loss, z
+        # all samples share one pass of the decoder, folded into the batch
+        z = self.sample(mean, logvar, self.samples)
+        output = self.decoder(z.flatten(0, 1), logits=True)
+        likelihood, prior = log_weights(output, data, z, mean, logvar)
+        normaliser = math.log(self.samples)
+        objective = -(torch.logsumexp(likelihood + self.beta * prior, 0) - normaliser).sum()
+        bound = -(torch.logsumexp(likelihood + prior, 0) - normaliser).sum()
+        output = output.view(self.samples, -1, *output.shape[1:])[0]
+        return output, objective, bound.detach(), z[0]
+
     def run_one_batch(self, data, optimiser=None, labels=None):
-        output, mean, logvar = self(data)
-        datasize = data.size(0)
-        data = data.reshape(output.shape)
-        loss = variational_loss(output, data, mean, logvar) / datasize
+        'returns logits: apply a sigmoid to see images'
+        output, objective, loss, _ = self.bound(data)
         if optimiser is not None:
             optimiser.zero_grad()
-            loss.backward()
+            (objective / data.size(0)).backward()
             optimiser.step()
-        return output, loss
+        return output, loss / data.size(0)
 
     def traverse(self, dataloader, limit=3, steps=10):
         # take the first image from dataloader, get mean, std of latent space
@@ -49,6 +102,8 @@ class VAE(Autoencoder):
         image = dataloader.dataset.__getitem__(0)[0]
         image = image.to(device).unsqueeze(0)
         mean, logvar = self.encoder(image, variational=True)
+        shape = mean.shape[1:]
+        mean, logvar = mean.flatten(1), logvar.flatten(1)
         width = mean.shape[1]
 
         # create 10 interpolation points between -3 and 3, multiply by stdev
@@ -61,4 +116,33 @@ class VAE(Autoencoder):
         # add the interpolations to mean to create the sampling
         mean = torch.cat(width * [torch.cat(steps * [mean]).unsqueeze(0)])
         mean[range(width), :, range(width)] += interpolation
-        return self.decoder(mean).view(width * steps, 1, 28, 28), steps
+        mean = mean.view(width * steps, *shape)
+        return self.decoder(mean).view(width * steps, *image.shape[1:]), steps
+
+
+def separate_passes(model, data, samples):
+    'the same bound as model.bound with one decoder pass per sample'
+    mean, logvar = model.encoder(data, variational=True)
+    z = model.sample(mean, logvar, samples)
+    output = torch.stack([model.decoder(z[k], logits=True) for k in range(samples)])
+    return importance_weighted_loss(output, data, z, mean, logvar)
+
+
+if __name__ == '__main__':
+    from models import models
+    data = torch.rand(64, 1, 28, 28).bernoulli()
+    for name in ['fnn', 'cnn']:
+        model = VAE(models[name][0](), models[name][1]())
+        for samples in [1, 5, 10]:
+            model.samples = samples
+            times = {}
+            for passes, loss in [('batched', lambda: model.bound(data)[1]),
+                                 ('separate', lambda: separate_passes(model, data, samples))]:
+                start = time.perf_counter()
+                for _ in range(10):
+                    loss().backward()
+                times[passes] = 100 * (time.perf_counter() - start)
+            # reported at beta 1 for every k, so the values are comparable
+            bound = separate_passes(model, data, samples)
+            print(f'{name} k={samples:<3} bound {-bound.item() / 64:9.2f}'
+                  f'  batched {times["batched"]:6.2f} ms  separate {times["separate"]:6.2f} ms')
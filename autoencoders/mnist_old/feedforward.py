@@ -7,7 +7,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import os
-from tqdm.autonotebook import tqdm
+from telemetry import Telemetry
 from torchvision.utils import save_image
 
 from dataloaders import *
@@ -70,32 +70,32 @@ class Autoencoder(nn.Module):
 
 
 def train(model, device, train_loader, optimizer, epoch):
-    progress = tqdm(enumerate(train_loader), desc="train", total=len(train_loader))
+    telemetry = Telemetry("train", len(train_loader), epoch)
     model.train()
     train_loss = 0
-    for i, (data, _) in progress:
+    for i, (data, _) in enumerate(telemetry.wrap(train_loader)):
         data = data.view(data.size(0), -1)
-        data = data.to(device)
+        data = telemetry.to(device, data)
         optimizer.zero_grad()
         output = model(data)
         loss = F.binary_cross_entropy(output, data)
         loss.backward()
         optimizer.step()
         train_loss += loss
-        progress.set_description("train loss: {:.4f}".format(train_loss/(i+1)))
+        telemetry.update(data.size(0), loss=train_loss/(i+1))
 
 
 def test(model, device, test_loader, folder, epoch):
-    progress = tqdm(enumerate(test_loader), desc="test", total=len(test_loader))
+    telemetry = Telemetry("test", len(test_loader), epoch)
     model.eval()
     test_loss = 0
     with torch.no_grad():
-        for i, (data, _) in progress:
+        for i, (data, _) in enumerate(telemetry.wrap(test_loader)):
             data = data.view(data.size(0), -1)
-            data = data.to(device)
+            data = telemetry.to(device, data)
             output = model(data)
             test_loss += F.binary_cross_entropy(output, data)
-            progress.set_description("test loss: {:.4f}".format(test_loss/(i+1)))
+            telemetry.update(data.size(0), loss=test_loss/(i+1))
             if i == 0:
                 output = output.view(100, 1, 28, 28)
                 data = data.view(100, 1, 28, 28)
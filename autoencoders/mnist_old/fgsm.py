@@ -8,7 +8,7 @@ import torch.nn.functional as F
 import torch.optim as optim
 import os
 import numpy as np
-from tqdm.autonotebook import tqdm
+from telemetry import Telemetry
 from torchvision.utils import save_image
 
 from dataloaders import *
@@ -84,12 +84,12 @@ def fgsm_attack(image, epsilon, data_grad):
 
 
 def train(model, device, train_loader, optimizer, epoch, folder):
-    progress = tqdm(enumerate(train_loader), desc="train", total=len(train_loader))
+    telemetry = Telemetry("train", len(train_loader), epoch)
     model.train()
     train_loss = 0
     grad = None
-    for i, (data, _) in progress:
-        data = data.to(device)
+    for i, (data, _) in enumerate(telemetry.wrap(train_loader)):
+        data = telemetry.to(device, data)
         optimizer.zero_grad()
 
         hidden = model.encoder(data)
@@ -115,19 +115,19 @@ def train(model, device, train_loader, optimizer, epoch, folder):
             save_image(output.cpu(), f'{folder}/{epoch}baseline.png', nrow=8)
 
         train_loss += batch_loss
-        progress.set_description("train loss: {:.4f}".format(train_loss/(i+1)))
+        telemetry.update(data.size(0), loss=train_loss/(i+1))
 
 
 def test(model, device, test_loader, folder, epoch):
-    progress = tqdm(enumerate(test_loader), desc="test", total=len(test_loader))
+    telemetry = Telemetry("test", len(test_loader), epoch)
     model.eval()
     test_loss = 0
     with torch.no_grad():
-        for i, (data, _) in progress:
-            data = data.to(device)
+        for i, (data, _) in enumerate(telemetry.wrap(test_loader)):
+            data = telemetry.to(device, data)
             output = model(data)
             test_loss += F.mse_loss(output, data)
-            progress.set_description("test loss: {:.4f}".format(test_loss/(i+1)))
+            telemetry.update(data.size(0), loss=test_loss/(i+1))
             if i == 0:
                 output = output.view(100, 1, 28, 28)
                 data = data.view(100, 1, 28, 28)
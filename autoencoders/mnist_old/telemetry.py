@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+rate limited progress bar plus structured step metrics
+"""
+import json
+import os
+import time
+import torch
+from tqdm.autonotebook import tqdm
+
+
+settings = {'console': True, 'interval': 0.5, 'jsonl': None, 'prometheus': None}
+latest = {}
+
+
+def configure(**kwargs):
+    'console, interval (seconds between updates), jsonl and prometheus paths'
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise ValueError(f'unknown telemetry settings {sorted(unknown)}')
+    settings.update(kwargs)
+
+
+def _float(value):
+    if isinstance(value, torch.Tensor):
+        return value.detach().item()
+    return float(value)
+
+
+class Telemetry:
+
+    def __init__(self, name, total=None, epoch=None, console=None):
+        'values passed to update() are only formatted every interval seconds'
+        self.name = name
+        self.epoch = epoch
+        console = settings['console'] if console is None else console
+        self.progress = tqdm(total=total, desc=name) if console else None
+        self.steps = 0
+        self.images = 0
+        self.values = {}
+        self.wait = 0.0
+        self.copy = 0.0
+        self.compute = 0.0
+        # set by to() once tensors go to a gpu, whose queued work has to be waited for
+        self.device = None
+        self.flushed = time.perf_counter()
+        self.since = {'steps': 0, 'images': 0, 'wait': 0.0, 'copy': 0.0, 'compute': 0.0}
+
+    def wrap(self, iterable):
+        'yield from iterable, timing the wait for each item and the work on it'
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                ready = time.perf_counter()
+                self.wait += ready - start
+                yield item
+                self._synchronize()
+                self.compute += time.perf_counter() - ready
+        finally:
+            # also when the consumer breaks out early or raises
+            self.close()
+
+    def to(self, device, *tensors):
+        'copy tensors to device, timing the host to device transfer'
+        if torch.device(device).type == 'cuda':
+            self.device = device
+        # kernels still queued belong to the step that queued them, not the copy
+        self._synchronize()
+        start = time.perf_counter()
+        tensors = [t.to(device, non_blocking=True) for t in tensors]
+        self._synchronize()
+        self.copy += time.perf_counter() - start
+        return tensors[0] if len(tensors) == 1 else tensors
+
+    def _synchronize(self):
+        if self.device is not None:
+            torch.cuda.synchronize(self.device)
+
+    def update(self, images=0, **values):
+        'count one step; values (tensors are fine) are what gets displayed'
+        self.steps += 1
+        self.images += images
+        self.values = values
+        if time.perf_counter() - self.flushed >= settings['interval']:
+            self.flush()
+
+    def flush(self):
+        now = time.perf_counter()
+        steps = self.steps - self.since['steps']
+        if steps == 0:
+            return
+        elapsed = now - self.flushed
+        values = {k: _float(v) for k, v in self.values.items()}
+        metrics = {
+            'name': self.name,
+            'epoch': self.epoch,
+            'step': self.steps,
+            'time': time.time(),
+            'step_time': (self.compute - self.since['compute']) / steps,
+            'data_wait': (self.wait - self.since['wait']) / steps,
+            'copy_time': (self.copy - self.since['copy']) / steps,
+            'images_per_sec': (self.images - self.since['images']) / elapsed,
+            **values,
+        }
+        metrics['compute_time'] = metrics['step_time'] - metrics['copy_time']
+        if self.progress is not None:
+            text = ' '.join(f'{k}: {v:.4f}' for k, v in values.items())
+            self.progress.set_description(f'{self.name} {text}', refresh=False)
+            self.progress.update(steps)
+        if settings['jsonl'] is not None:
+            with open(settings['jsonl'], 'a') as f:
+                f.write(json.dumps(metrics) + '\n')
+        if settings['prometheus'] is not None:
+            self._prometheus(metrics)
+        self.flushed = now
+        self.since = {'steps': self.steps, 'images': self.images, 'wait': self.wait,
+                      'copy': self.copy, 'compute': self.compute}
+
+    def _prometheus(self, metrics):
+        'textfile collector format holding the latest metrics of every phase'
+        latest[self.name] = metrics
+        gauges = {}
+        for phase, values in latest.items():
+            for key, value in values.items():
+                if key not in ['name', 'epoch', 'time'] and value is not None:
+                    gauges.setdefault(key, []).append(
+                        f'autoencoders_{key}{{phase="{phase}"}} {value}')
+        lines = []
+        for key, samples in gauges.items():
+            lines += [f'# TYPE autoencoders_{key} gauge'] + samples
+        path = settings['prometheus']
+        with open(f'{path}.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f'{path}.tmp', path)
+
+    def close(self):
+        self.flush()
+        if self.progress is not None:
+            self.progress.close()
+            self.progress = None